@@ -1,42 +1,236 @@
 # ارتباط با API پنل 3X-UI
 
+import asyncio
 import aiohttp
+import codecs
 import json
 import uuid
 import time
 from typing import Optional
-from config import PANEL_URL, PANEL_USERNAME, PANEL_PASSWORD
+from config import (
+    PANEL_URL, PANEL_USERNAME, PANEL_PASSWORD,
+    PANEL_POOL_SIZE, PANEL_POOL_PER_HOST, PANEL_KEEPALIVE_SECONDS,
+    PANEL_REQUEST_TIMEOUT, PANEL_PERSIST_SESSION,
+    INBOUNDS_CACHE_TTL_SECONDS, INBOUNDS_CACHE_STALE_SECONDS,
+    CLIENT_INDEX_TTL_SECONDS, INBOUND_MEMO_TTL_SECONDS,
+    CLIENT_TRAFFIC_DIRECT_MAX, CLIENT_TRAFFIC_CONCURRENCY,
+    BULK_CREATE_CHUNK_SIZE, PLACEMENT_TRAFFIC_WEIGHT
+)
+from database import (
+    get_setting, set_setting, delete_setting, get_panel_nodes, get_panel_node, set_default_panel_node
+)
+from models import Inbound, Client, ClientStat, ClientTraffic
+
+
+# کلید ذخیره کوکی پنل در جدول settings
+SESSION_SETTING_KEY = "panel_session_cookies"
+
+# اندازه هر تکه خواندن پاسخ‌های لیستی بزرگ (بایت)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# پروتکل‌هایی که ساخت کلاینت و لینک کانفیگ برایشان پشتیبانی می‌شود
+LINK_PROTOCOLS = ("vless", "vmess", "trojan")
+
+
+class _JSONStream:
+    """پارس تدریجی پاسخ JSON پنل - آیتم‌های آرایه obj بدون بافر کردن کل پاسخ خوانده می‌شوند"""
+    
+    def __init__(self, content: aiohttp.StreamReader):
+        self._content = content
+        self._decoder = json.JSONDecoder()
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        # سایر فیلدهای سطح اول پاسخ (success، msg)
+        self.fields: dict = {}
+    
+    async def _fill(self, min_size: int = 0) -> bool:
+        """خواندن دست‌کم min_size کاراکتر جدید و حذف بخش مصرف شده بافر
+        
+        تکه‌ها در لیست جمع و فقط یک بار به بافر وصل می‌شوند تا مقدار بزرگ بارها کپی نشود.
+        """
+        if self._eof:
+            return False
+        chunks = [self._buf[self._pos:]]
+        size = 0
+        while True:
+            chunk = await self._content.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                self._eof = True
+            text = self._utf8.decode(chunk, final=self._eof)
+            chunks.append(text)
+            size += len(text)
+            if self._eof or size >= min_size:
+                break
+        self._buf = "".join(chunks)
+        self._pos = 0
+        return not self._eof
+    
+    async def _peek(self) -> str:
+        """اولین کاراکتر غیر فاصله (بدون مصرف) - در پایان داده رشته خالی"""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in " \t\r\n":
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not await self._fill():
+                return ""
+    
+    async def _expect(self, char: str):
+        found = await self._peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON: expected {char!r}, got {found!r}")
+        self._pos += 1
+    
+    async def _value(self):
+        """خواندن یک مقدار کامل JSON"""
+        await self._peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # عدد در انتهای بافر ممکن است ناقص باشد
+                if end < len(self._buf) or self._eof or not isinstance(value, (int, float)):
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            # مقدار ناقص است - داده بافر شده دو برابر می‌شود تا پارس تکرار نشود
+            await self._fill(len(self._buf) - self._pos)
+    
+    async def _members(self):
+        """کلیدهای شیء JSON (بعد از '{') - مقدار هر کلید را فراخوان می‌خواند"""
+        while True:
+            found = await self._peek()
+            if found == "}":
+                self._pos += 1
+                return
+            if found == ",":
+                self._pos += 1
+                continue
+            if not found:
+                raise ValueError("Invalid JSON: unexpected end")
+            name = await self._value()
+            await self._expect(":")
+            yield name
+    
+    async def _elements(self):
+        """عناصر آرایه JSON (بعد از '[') - هر عنصر را فراخوان می‌خواند"""
+        while True:
+            found = await self._peek()
+            if found == "]":
+                self._pos += 1
+                return
+            if found == ",":
+                self._pos += 1
+                continue
+            if not found:
+                raise ValueError("Invalid JSON: unexpected end")
+            yield
+    
+    async def _object(self, nested: dict) -> dict:
+        """خواندن یک شیء - آرایه کلیدهای nested عنصر به عنصر خوانده و با تابع آن تبدیل می‌شود"""
+        await self._expect("{")
+        obj = {}
+        async for name in self._members():
+            convert = nested.get(name)
+            if convert is not None and await self._peek() == "[":
+                self._pos += 1
+                obj[name] = [convert(await self._value()) async for _ in self._elements()]
+            else:
+                obj[name] = await self._value()
+        return obj
+    
+    async def items(self, key: str = "obj", nested: dict = None):
+        """آیتم‌های آرایه key به ترتیب
+        
+        nested: نام فیلد -> تابع تبدیل، برای آرایه‌های داخل هر آیتم (مثل clientStats)
+        تا عناصرشان یکی‌یکی پارس شوند و آیتم بزرگ یک‌جا بافر نشود.
+        """
+        await self._expect("{")
+        async for name in self._members():
+            if name != key or await self._peek() != "[":
+                self.fields[name] = await self._value()
+                continue
+            
+            self._pos += 1
+            async for _ in self._elements():
+                if nested and await self._peek() == "{":
+                    yield await self._object(nested)
+                else:
+                    yield await self._value()
 
 
 class Panel3XUI:
-    def __init__(self):
-        self.base_url = PANEL_URL
-        self.username = PANEL_USERNAME
-        self.password = PANEL_PASSWORD
+    def __init__(self, base_url: str = None, username: str = None, password: str = None,
+                 panel_id: int = 1, name: str = "main"):
+        # بدون پارامتر، پنل اصلی از تنظیمات استفاده می‌شود
+        self.base_url = base_url or PANEL_URL
+        self.username = username or PANEL_USERNAME
+        self.password = password or PANEL_PASSWORD
+        self.panel_id = panel_id
+        self.name = name
+        # پنل غیرفعال کانفیگ جدید نمی‌گیرد ولی کانفیگ‌های قبلی‌اش مدیریت و همگام می‌شوند
+        self.is_active = True
         self.session: Optional[aiohttp.ClientSession] = None
-        self.cookies = None
+        self.cookies: Optional[dict] = None
+        # هر تلاش برای لاگین این شمارنده را افزایش می‌دهد
+        # تا درخواست‌های همزمان فقط یک بار دوباره لاگین کنند
+        self._auth_generation = 0
+        self._login_lock = asyncio.Lock()
+        # کش لیست inboundها
+        self._inbounds_cache: Optional[list] = None
+        self._inbounds_fetched_at = 0.0
+        self._inbounds_version = 0
+        self._inbounds_task: Optional[asyncio.Task] = None
+        self._inbounds_task_version = -1
+        # خطای آخرین دریافت ناموفق لیست
+        self._inbounds_error: Optional[Exception] = None
+        # ایندکس کلاینت‌ها: ایمیل -> (inbound_id, client) و uuid -> ایمیل
+        self._client_index: dict[str, tuple[int, dict]] = {}
+        self._client_ids: dict[str, str] = {}
+        self._inbound_remarks: dict[int, str] = {}
+        self._client_index_at: Optional[float] = None
+        # لیست دریافت شده‌ای که ایندکس هنوز از آن ساخته نشده
+        self._pending_index: Optional[list] = None
+        # حافظه inboundهای پارس شده برای ساخت لینک: inbound_id -> (زمان، داده)
+        self._parsed_inbounds: dict[int, tuple[float, dict]] = {}
+        # بار inboundها برای انتخاب خودکار: inbound_id -> (تعداد کلاینت، کل ترافیک، بایت بر ثانیه)
+        self._inbound_load: dict[int, tuple[int, int, float]] = {}
+        self._inbound_load_at: Optional[float] = None
     
     async def __aenter__(self):
         await self.create_session()
-        await self.login()
+        await self.ensure_login()
         return self
     
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close_session()
     
     async def create_session(self):
-        """ایجاد session جدید"""
+        """ایجاد session جدید با connection pool محدود و keep-alive"""
         if self.session is None or self.session.closed:
-            connector = aiohttp.TCPConnector(ssl=False)
-            self.session = aiohttp.ClientSession(connector=connector)
+            connector = aiohttp.TCPConnector(
+                ssl=False,
+                limit=PANEL_POOL_SIZE,
+                limit_per_host=PANEL_POOL_PER_HOST,
+                keepalive_timeout=PANEL_KEEPALIVE_SECONDS,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(total=PANEL_REQUEST_TIMEOUT)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=timeout)
     
     async def close_session(self):
         """بستن session"""
+        if self._inbounds_task and not self._inbounds_task.done():
+            self._inbounds_task.cancel()
         if self.session and not self.session.closed:
             await self.session.close()
     
     async def login(self) -> bool:
         """ورود به پنل و دریافت کوکی"""
+        self._auth_generation += 1
         try:
             url = f"{self.base_url}/login"
             data = {
@@ -48,38 +242,332 @@ class Panel3XUI:
                 if response.status == 200:
                     result = await response.json()
                     if result.get("success"):
-                        self.cookies = response.cookies
+                        self.cookies = {
+                            name: morsel.value for name, morsel in response.cookies.items()
+                        }
+                        await self._save_cookies()
                         return True
                 return False
         except Exception as e:
             print(f"Login error: {e}")
             return False
     
-    async def _request(self, method: str, endpoint: str, data: dict = None) -> dict:
-        """ارسال درخواست به API"""
+    async def ensure_login(self) -> bool:
+        """استفاده از کوکی ذخیره شده در صورت وجود، در غیر این صورت لاگین"""
+        if self.cookies:
+            return True
+        if await self._load_cookies():
+            return True
+        return await self.login()
+    
+    async def _relogin(self, seen_generation: int) -> bool:
+        """لاگین مجدد تک‌پروازی - اگر درخواست دیگری زودتر لاگین کرده، دوباره لاگین نمی‌کند"""
+        async with self._login_lock:
+            if self._auth_generation != seen_generation:
+                return self.cookies is not None
+            if await self.login():
+                return True
+            # کوکی رد شده نباید پس از ری‌استارت دوباره بارگذاری شود
+            await self._clear_cookies()
+            return False
+    
+    @property
+    def _session_key(self) -> str:
+        """کلید ذخیره کوکی - برای هر پنل جدا"""
+        if self.panel_id == 1:
+            return SESSION_SETTING_KEY
+        return f"{SESSION_SETTING_KEY}:{self.panel_id}"
+    
+    async def _load_cookies(self) -> bool:
+        """بارگذاری کوکی از دیتابیس"""
+        if not PANEL_PERSIST_SESSION:
+            return False
+        try:
+            raw = await get_setting(self._session_key)
+            if not raw:
+                return False
+            stored = json.loads(raw)
+            if stored.get("base_url") != self.base_url or not stored.get("cookies"):
+                return False
+            self.cookies = stored["cookies"]
+            return True
+        except Exception as e:
+            print(f"Load session error: {e}")
+            return False
+    
+    async def _save_cookies(self):
+        """ذخیره کوکی در دیتابیس"""
+        if not PANEL_PERSIST_SESSION:
+            return
+        try:
+            await set_setting(
+                self._session_key,
+                json.dumps({"base_url": self.base_url, "cookies": self.cookies})
+            )
+        except Exception as e:
+            print(f"Save session error: {e}")
+    
+    async def _clear_cookies(self):
+        """حذف کوکی از حافظه و دیتابیس"""
+        self.cookies = None
+        if PANEL_PERSIST_SESSION:
+            await delete_setting(self._session_key)
+    
+    @staticmethod
+    def _is_auth_failure(response: aiohttp.ClientResponse) -> bool:
+        """تشخیص رد شدن کوکی توسط پنل (401/403/404، ریدایرکت یا پاسخ غیر JSON)
+        
+        نسخه‌های جدید 3X-UI به درخواست /panel/api بدون session پاسخ 404 خالی می‌دهند.
+        """
+        if response.status in (401, 403, 404) or 300 <= response.status < 400:
+            return True
+        return "json" not in response.headers.get("Content-Type", "")
+    
+    async def _request(self, method: str, endpoint: str, data: dict = None,
+                       _retry: bool = True) -> dict:
+        """ارسال درخواست به API - در صورت منقضی شدن session یک بار دوباره لاگین می‌کند"""
+        method = method.upper()
+        if method not in ("GET", "POST"):
+            return {"success": False, "msg": "Invalid method"}
+        
         try:
             url = f"{self.base_url}{endpoint}"
+            seen_generation = self._auth_generation
             
-            if method.upper() == "GET":
-                async with self.session.get(url, cookies=self.cookies) as response:
-                    return await response.json()
-            elif method.upper() == "POST":
-                async with self.session.post(url, json=data, cookies=self.cookies) as response:
-                    return await response.json()
-            else:
-                return {"success": False, "msg": "Invalid method"}
+            async with self.session.request(
+                method, url,
+                json=data if method == "POST" else None,
+                cookies=self.cookies,
+                allow_redirects=False
+            ) as response:
+                if not self._is_auth_failure(response):
+                    try:
+                        return await response.json()
+                    except ValueError:
+                        # بدنه JSON نیست (مثلاً صفحه لاگین) - مثل session منقضی رفتار می‌شود
+                        pass
         except Exception as e:
             print(f"Request error: {e}")
             return {"success": False, "msg": str(e)}
+        
+        if _retry and await self._relogin(seen_generation):
+            return await self._request(method, endpoint, data, _retry=False)
+        return {"success": False, "msg": "Unauthorized"}
+    
+    async def _stream_list(self, endpoint: str, nested: dict = None, _retry: bool = True):
+        """دریافت یک endpoint لیستی با پارس تدریجی - آیتم‌های obj یکی‌یکی برگردانده می‌شوند
+        
+        در صورت خطا یا پاسخ ناموفق exception ایجاد می‌شود.
+        """
+        url = f"{self.base_url}{endpoint}"
+        seen_generation = self._auth_generation
+        
+        async with self.session.get(url, cookies=self.cookies, allow_redirects=False) as response:
+            if not self._is_auth_failure(response):
+                stream = _JSONStream(response.content)
+                async for item in stream.items(nested=nested):
+                    yield item
+                if not stream.fields.get("success", True):
+                    raise ValueError(stream.fields.get("msg") or "Request failed")
+                return
+        
+        if _retry and await self._relogin(seen_generation):
+            async for item in self._stream_list(endpoint, nested, _retry=False):
+                yield item
+            return
+        raise ValueError("Unauthorized")
     
     # ==================== Inbound Operations ====================
     
-    async def get_inbounds(self) -> list:
-        """دریافت لیست inboundها"""
-        result = await self._request("GET", "/panel/api/inbounds/list")
-        if result.get("success"):
-            return result.get("obj", [])
-        return []
+    async def get_inbounds(self, force_refresh: bool = False, allow_stale: bool = False) -> list:
+        """دریافت لیست inboundها (از کش در صورت تازه بودن)
+        
+        allow_stale: اگر کش منقضی شده ولی هنوز در بازه stale است، همان برگردانده
+        شده و بروزرسانی در پس‌زمینه انجام می‌شود؛ در خطای دریافت هم کش قبلی برگردانده می‌شود.
+        force_refresh: در خطای دریافت ConnectionError داده می‌شود تا داده قدیمی تازه فرض نشود.
+        لیست برگشتی بین فراخوانی‌ها مشترک است و نباید تغییر داده شود.
+        """
+        cache = self._inbounds_cache
+        if cache is not None and not force_refresh:
+            age = time.monotonic() - self._inbounds_fetched_at
+            if age < INBOUNDS_CACHE_TTL_SECONDS:
+                return cache
+            if allow_stale and age < INBOUNDS_CACHE_STALE_SECONDS:
+                self._start_inbounds_fetch()
+                return cache
+        
+        inbounds = await asyncio.shield(self._start_inbounds_fetch())
+        if inbounds is None:
+            if force_refresh:
+                raise ConnectionError(f"Failed to fetch inbounds: {self._inbounds_error}")
+            if allow_stale and cache is not None:
+                return cache
+            return []
+        return inbounds
+    
+    def _inbounds_fresh(self) -> bool:
+        """بررسی تازه بودن کش لیست inboundها"""
+        return (self._inbounds_cache is not None and
+                time.monotonic() - self._inbounds_fetched_at < INBOUNDS_CACHE_TTL_SECONDS)
+    
+    def invalidate_inbounds(self, inbound_id: int = None):
+        """باطل کردن کش inboundها (بعد از تغییر کلاینت‌ها)"""
+        self._inbounds_version += 1
+        self._inbounds_cache = None
+        self._inbounds_fetched_at = 0.0
+        if inbound_id is None:
+            self._parsed_inbounds.clear()
+        else:
+            self._parsed_inbounds.pop(inbound_id, None)
+    
+    def _start_inbounds_fetch(self) -> asyncio.Task:
+        """شروع دریافت لیست - درخواست‌های همزمان به یک دریافت مشترک وصل می‌شوند"""
+        task = self._inbounds_task
+        if task is None or task.done() or self._inbounds_task_version != self._inbounds_version:
+            self._inbounds_task_version = self._inbounds_version
+            task = asyncio.create_task(self._fetch_inbounds(self._inbounds_version))
+            self._inbounds_task = task
+        return task
+    
+    async def _fetch_inbounds(self, version: int) -> Optional[list]:
+        """دریافت لیست inboundها از پنل و ذخیره در کش"""
+        try:
+            inbounds = [
+                Inbound.from_json(inbound)
+                async for inbound in self._stream_list(
+                    "/panel/api/inbounds/list", {"clientStats": ClientStat.from_json}
+                )
+            ]
+        except Exception as e:
+            print(f"Request error: {e}")
+            self._inbounds_error = e
+            return None
+        
+        # اگر در حین دریافت کش باطل شده، نتیجه قدیمی ذخیره نشود
+        if version == self._inbounds_version:
+            self._inbounds_cache = inbounds
+            self._inbounds_fetched_at = time.monotonic()
+            # ایندکس کلاینت‌ها (پارس settings) فقط هنگام اولین جستجو ساخته می‌شود
+            self._pending_index = inbounds
+            self._client_index_at = self._inbounds_fetched_at
+            self._update_inbound_load(inbounds)
+        return inbounds
+    
+    def _update_inbound_load(self, inbounds: list):
+        """محاسبه بار هر inbound از clientStats همان لیست (بدون درخواست اضافه)"""
+        now = time.monotonic()
+        elapsed = now - self._inbound_load_at if self._inbound_load_at else 0
+        load = {}
+        
+        for inbound in inbounds:
+            stats = inbound.clientStats
+            total = sum(stat.up + stat.down for stat in stats)
+            inbound_id = inbound.id
+            
+            # سرعت ترافیک اخیر از تفاوت با دریافت قبلی (ریست ترافیک = صفر)
+            previous = self._inbound_load.get(inbound_id)
+            rate = previous[2] if previous else 0.0
+            if previous and elapsed > 0:
+                rate = max(0, total - previous[1]) / elapsed
+            load[inbound_id] = (len(stats), total, rate)
+        
+        self._inbound_load = load
+        self._inbound_load_at = now
+    
+    def get_inbound_load(self, inbound: dict) -> tuple[int, float]:
+        """بار یک inbound: (تعداد کلاینت، بایت بر ثانیه ترافیک اخیر)"""
+        load = self._inbound_load.get(inbound.get("id"))
+        if load is None:
+            return len(inbound.get("clientStats") or []), 0.0
+        return load[0], load[2]
+    
+    def _add_inbound_load(self, inbound_id: int, clients: int):
+        """ثبت کلاینت‌های جدید در بار inbound تا انتخاب‌های بعدی پخش شوند"""
+        load = self._inbound_load.get(inbound_id)
+        if load:
+            self._inbound_load[inbound_id] = (load[0] + clients, load[1], load[2])
+    
+    # ==================== Client Index ====================
+    
+    def _rebuild_client_index(self, inbounds: list):
+        """ساخت ایندکس کلاینت‌ها از لیست inboundها"""
+        index = {}
+        ids = {}
+        remarks = {}
+        
+        for inbound in inbounds:
+            inbound_id = inbound.id
+            remarks[inbound_id] = inbound.remark
+            try:
+                settings = json.loads(inbound.settings or "{}")
+            except ValueError:
+                continue
+            
+            for data in settings.get("clients", []):
+                email = data.get("email")
+                if not email:
+                    continue
+                client = Client.from_json(data)
+                index[email] = (inbound_id, client)
+                client_id = client.id or client.password
+                if client_id:
+                    ids[client_id] = email
+        
+        self._client_index = index
+        self._client_ids = ids
+        self._inbound_remarks = remarks
+    
+    def _ensure_client_index(self):
+        """ساخت ایندکس از آخرین لیست دریافت شده در صورت نیاز"""
+        if self._pending_index is not None:
+            inbounds, self._pending_index = self._pending_index, None
+            self._rebuild_client_index(inbounds)
+    
+    def _index_client(self, inbound_id: int, data: dict):
+        """افزودن یا بروزرسانی یک کلاینت در ایندکس"""
+        self._ensure_client_index()
+        client = Client.from_json(data)
+        email = client.email
+        previous = self._client_index.get(email)
+        if previous:
+            old_id = previous[1].id or previous[1].password
+            self._client_ids.pop(old_id, None)
+        
+        self._client_index[email] = (inbound_id, client)
+        client_id = client.id or client.password
+        if client_id:
+            self._client_ids[client_id] = email
+    
+    def _unindex_client(self, uuid_str: str):
+        """حذف یک کلاینت از ایندکس"""
+        self._ensure_client_index()
+        email = self._client_ids.pop(uuid_str, None)
+        if email:
+            self._client_index.pop(email, None)
+    
+    def _client_index_fresh(self) -> bool:
+        """بررسی تازه بودن ایندکس"""
+        return (self._client_index_at is not None and
+                time.monotonic() - self._client_index_at < CLIENT_INDEX_TTL_SECONDS)
+    
+    async def _lookup_client(self, email: str) -> Optional[tuple[int, dict]]:
+        """جستجوی کلاینت در ایندکس - فقط در صورت نیاز لیست از پنل گرفته می‌شود"""
+        if not self._client_index_fresh():
+            await self.get_inbounds()
+            self._ensure_client_index()
+            return self._client_index.get(email)
+        
+        self._ensure_client_index()
+        entry = self._client_index.get(email)
+        if entry is None and time.monotonic() - self._client_index_at >= INBOUNDS_CACHE_TTL_SECONDS:
+            # ممکن است کلاینت خارج از ربات ساخته شده باشد
+            try:
+                await self.get_inbounds(force_refresh=True)
+            except ConnectionError:
+                return None
+            self._ensure_client_index()
+            entry = self._client_index.get(email)
+        return entry
     
     async def get_inbound(self, inbound_id: int) -> dict:
         """دریافت اطلاعات یک inbound"""
@@ -90,10 +578,11 @@ class Panel3XUI:
     
     # ==================== Client Operations ====================
     
-    async def add_client(self, inbound_id: int, email: str, uuid_str: str = None,
-                         total_gb: float = 0, expiry_time: int = 0,
-                         limit_ip: int = 0, enable: bool = True) -> dict:
-        """افزودن کلاینت جدید به inbound"""
+    @staticmethod
+    def _build_client_data(email: str, uuid_str: str = None, total_gb: float = 0,
+                           expiry_time: int = 0, limit_ip: int = 0,
+                           enable: bool = True) -> dict:
+        """ساخت داده کلاینت برای ارسال به پنل"""
         if uuid_str is None:
             uuid_str = str(uuid.uuid4())
         
@@ -103,7 +592,7 @@ class Panel3XUI:
         # تبدیل زمان به میلی‌ثانیه
         expiry_ms = expiry_time * 1000 if expiry_time > 0 else 0
         
-        client_data = {
+        return {
             "id": uuid_str,
             "email": email,
             "limitIp": limit_ip,
@@ -114,6 +603,14 @@ class Panel3XUI:
             "subId": str(uuid.uuid4())[:8],
             "reset": 0
         }
+    
+    async def add_client(self, inbound_id: int, email: str, uuid_str: str = None,
+                         total_gb: float = 0, expiry_time: int = 0,
+                         limit_ip: int = 0, enable: bool = True) -> dict:
+        """افزودن کلاینت جدید به inbound"""
+        client_data = self._build_client_data(
+            email, uuid_str, total_gb, expiry_time, limit_ip, enable
+        )
         
         data = {
             "id": inbound_id,
@@ -123,9 +620,12 @@ class Panel3XUI:
         result = await self._request("POST", "/panel/api/inbounds/addClient", data)
         
         if result.get("success"):
+            self.invalidate_inbounds(inbound_id)
+            self._index_client(inbound_id, client_data)
+            self._add_inbound_load(inbound_id, 1)
             return {
                 "success": True,
-                "uuid": uuid_str,
+                "uuid": client_data["id"],
                 "email": email,
                 "msg": "Client added successfully"
             }
@@ -134,6 +634,53 @@ class Panel3XUI:
             "msg": result.get("msg", "Failed to add client")
         }
     
+    async def add_clients(self, inbound_id: int, specs: list,
+                          chunk_size: int = BULK_CREATE_CHUNK_SIZE) -> dict:
+        """افزودن گروهی کلاینت‌ها - چند کلاینت در هر درخواست addClient
+        
+        specs: لیست دیکشنری با کلیدهای email و اختیاری total_gb، expiry_time، limit_ip
+        """
+        created = []
+        failed = []
+        
+        clients = [
+            self._build_client_data(
+                spec["email"],
+                spec.get("uuid"),
+                spec.get("total_gb", 0),
+                spec.get("expiry_time", 0),
+                spec.get("limit_ip", 0)
+            )
+            for spec in specs
+        ]
+        
+        for i in range(0, len(clients), chunk_size):
+            chunk = clients[i:i + chunk_size]
+            data = {
+                "id": inbound_id,
+                "settings": json.dumps({"clients": chunk})
+            }
+            
+            result = await self._request("POST", "/panel/api/inbounds/addClient", data)
+            
+            if result.get("success"):
+                for client_data in chunk:
+                    self._index_client(inbound_id, client_data)
+                    created.append({"email": client_data["email"], "uuid": client_data["id"]})
+            else:
+                msg = result.get("msg", "Failed to add clients")
+                failed.extend({"email": c["email"], "msg": msg} for c in chunk)
+        
+        if created:
+            self.invalidate_inbounds(inbound_id)
+            self._add_inbound_load(inbound_id, len(created))
+        
+        return {
+            "success": bool(created) and not failed,
+            "created": created,
+            "failed": failed
+        }
+    
     async def delete_client(self, inbound_id: int, uuid_str: str) -> dict:
         """حذف کلاینت از inbound"""
         result = await self._request(
@@ -141,6 +688,9 @@ class Panel3XUI:
             f"/panel/api/inbounds/{inbound_id}/delClient/{uuid_str}",
             {}
         )
+        if result.get("success"):
+            self.invalidate_inbounds(inbound_id)
+            self._unindex_client(uuid_str)
         return result
     
     async def update_client(self, inbound_id: int, uuid_str: str, email: str,
@@ -185,31 +735,68 @@ class Panel3XUI:
             f"/panel/api/inbounds/updateClient/{uuid_str}",
             data
         )
+        if result.get("success"):
+            self.invalidate_inbounds(inbound_id)
+            self._index_client(inbound_id, current_client)
         return result
     
+    async def set_clients_enabled(self, inbound_id: int, emails: list, enable: bool,
+                                  concurrency: int = 1) -> dict:
+        """فعال/غیرفعال کردن چند کلاینت یک inbound با یک بار دریافت inbound
+        
+        کش لیست inboundها باطل نمی‌شود - فراخوان پس از پایان همه گروه‌ها invalidate_inbounds
+        را صدا می‌زند. خروجی: ایمیل -> True (موفق)، None (کلاینت در inbound نیست) یا False (خطا)
+        """
+        inbound = await self.get_inbound(inbound_id)
+        if not inbound:
+            return {email: False for email in emails}
+        
+        settings = json.loads(inbound.get("settings") or "{}")
+        clients = {client.get("email"): client for client in settings.get("clients", [])}
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def update(email: str) -> Optional[bool]:
+            client = clients.get(email)
+            if client is None:
+                return None
+            client["enable"] = enable
+            data = {
+                "id": inbound_id,
+                "settings": json.dumps({"clients": [client]})
+            }
+            async with semaphore:
+                result = await self._request(
+                    "POST",
+                    f"/panel/api/inbounds/updateClient/{client.get('id') or client.get('password')}",
+                    data
+                )
+            if result.get("success"):
+                self._index_client(inbound_id, client)
+                return True
+            return False
+        
+        results = await asyncio.gather(*(update(email) for email in emails))
+        return dict(zip(emails, results))
+    
     async def get_client_traffic(self, email: str) -> dict:
-        """دریافت ترافیک کلاینت"""
+        """دریافت ترافیک کلاینت (بایت)"""
         result = await self._request(
             "GET",
             f"/panel/api/inbounds/getClientTraffics/{email}"
         )
         
-        if result.get("success"):
-            obj = result.get("obj", {})
-            # تبدیل بایت به گیگابایت
+        # کلاینت ناموجود با success و obj خالی برمی‌گردد
+        obj = result.get("obj") or {}
+        if result.get("success") and obj:
             up = obj.get("up", 0)
             down = obj.get("down", 0)
-            total = up + down
             
             return {
                 "success": True,
                 "email": email,
-                "upload_gb": round(up / (1024**3), 3),
-                "download_gb": round(down / (1024**3), 3),
-                "total_gb": round(total / (1024**3), 3),
                 "upload_bytes": up,
                 "download_bytes": down,
-                "total_bytes": total
+                "total_bytes": up + down
             }
         return {
             "success": False,
@@ -218,34 +805,51 @@ class Panel3XUI:
         }
     
     async def get_all_clients_traffic(self, inbound_id: int = None) -> list:
-        """دریافت ترافیک همه کلاینت‌ها"""
+        """دریافت ترافیک همه کلاینت‌ها (بایت)"""
         clients_traffic = []
         
-        inbounds = await self.get_inbounds()
+        # همگام‌سازی ترافیک همیشه داده تازه می‌خواهد
+        inbounds = await self.get_inbounds(force_refresh=True)
         
         for inbound in inbounds:
-            if inbound_id and inbound.get("id") != inbound_id:
+            if inbound_id and inbound.id != inbound_id:
                 continue
             
-            # گرفتن clientStats از inbound
-            client_stats = inbound.get("clientStats", [])
-            
-            for stat in client_stats:
-                up = stat.get("up", 0)
-                down = stat.get("down", 0)
-                total = up + down
-                
-                clients_traffic.append({
-                    "email": stat.get("email"),
-                    "inbound_id": stat.get("inboundId"),
-                    "enable": stat.get("enable", True),
-                    "upload_gb": round(up / (1024**3), 3),
-                    "download_gb": round(down / (1024**3), 3),
-                    "total_gb": round(total / (1024**3), 3)
-                })
+            for stat in inbound.clientStats:
+                clients_traffic.append(ClientTraffic(
+                    stat.email, stat.inbound_id, stat.enable, stat.up, stat.down
+                ))
         
         return clients_traffic
     
+    async def get_clients_traffic(self, emails: list) -> dict:
+        """ترافیک چند کلاینت مشخص (بایت): ایمیل -> ترافیک
+        
+        کش تازه لیست بدون درخواست استفاده می‌شود؛ در غیر این صورت برای تعداد کم کلاینت
+        getClientTraffics با همزمانی محدود و برای تعداد زیاد یک دریافت لیست.
+        کلاینتی که ترافیکش دریافت نشد در نتیجه نیست.
+        """
+        fresh = self._inbounds_fresh()
+        if not fresh and len(emails) <= CLIENT_TRAFFIC_DIRECT_MAX:
+            semaphore = asyncio.Semaphore(CLIENT_TRAFFIC_CONCURRENCY)
+            
+            async def fetch(email: str) -> dict:
+                async with semaphore:
+                    return await self.get_client_traffic(email)
+            
+            results = await asyncio.gather(*(fetch(email) for email in emails))
+            return {r["email"]: r["total_bytes"] for r in results if r["success"]}
+        
+        # در خطای دریافت ConnectionError داده می‌شود
+        inbounds = await self.get_inbounds(force_refresh=not fresh)
+        wanted = set(emails)
+        return {
+            stat.email: stat.up + stat.down
+            for inbound in inbounds
+            for stat in inbound.clientStats
+            if stat.email in wanted
+        }
+    
     async def reset_client_traffic(self, inbound_id: int, email: str) -> dict:
         """ریست ترافیک کلاینت"""
         result = await self._request(
@@ -253,6 +857,8 @@ class Panel3XUI:
             f"/panel/api/inbounds/{inbound_id}/resetClientTraffic/{email}",
             {}
         )
+        if result.get("success"):
+            self.invalidate_inbounds(inbound_id)
         return result
     
     async def get_client_ips(self, email: str) -> dict:
@@ -267,64 +873,90 @@ class Panel3XUI:
     # ==================== Helper Functions ====================
     
     async def get_client_by_email(self, email: str) -> dict:
-        """پیدا کردن کلاینت با ایمیل"""
-        inbounds = await self.get_inbounds()
+        """پیدا کردن کلاینت با ایمیل (از ایندکس)"""
+        entry = await self._lookup_client(email)
+        if entry is None:
+            return {"success": False, "msg": "Client not found"}
         
-        for inbound in inbounds:
-            settings = json.loads(inbound.get("settings", "{}"))
-            clients = settings.get("clients", [])
-            
-            for client in clients:
-                if client.get("email") == email:
-                    return {
-                        "success": True,
-                        "client": client,
-                        "inbound_id": inbound.get("id"),
-                        "inbound_remark": inbound.get("remark")
-                    }
+        inbound_id, client = entry
+        return {
+            "success": True,
+            "client": client,
+            "inbound_id": inbound_id,
+            "inbound_remark": self._inbound_remarks.get(inbound_id)
+        }
+    
+    async def get_client_by_uuid(self, uuid_str: str) -> dict:
+        """پیدا کردن کلاینت با UUID (از ایندکس)"""
+        if not self._client_index_fresh():
+            await self.get_inbounds()
+        self._ensure_client_index()
         
-        return {"success": False, "msg": "Client not found"}
+        email = self._client_ids.get(uuid_str)
+        if email is None:
+            return {"success": False, "msg": "Client not found"}
+        return await self.get_client_by_email(email)
     
-    async def get_subscription_link(self, inbound_id: int, email: str) -> str:
-        """ساخت لینک اشتراک"""
-        inbound = await self.get_inbound(inbound_id)
-        if not inbound:
-            return ""
+    async def _get_parsed_inbound(self, inbound_id: int) -> Optional[dict]:
+        """دریافت inbound با settings و streamSettings پارس شده
         
-        # پیدا کردن کلاینت
-        settings = json.loads(inbound.get("settings", "{}"))
-        clients = settings.get("clients", [])
+        از حافظه کوتاه‌مدت یا کش لیست استفاده می‌شود و فقط در صورت نبودن،
+        یک درخواست به پنل ارسال می‌شود.
+        """
+        memo = self._parsed_inbounds.get(inbound_id)
+        if memo and time.monotonic() - memo[0] < INBOUND_MEMO_TTL_SECONDS:
+            return memo[1]
         
-        client = None
-        for c in clients:
-            if c.get("email") == email:
-                client = c
-                break
+        inbound = None
+        if self._inbounds_fresh():
+            inbound = next(
+                (i for i in self._inbounds_cache if i.id == inbound_id), None
+            )
+        if inbound is None:
+            inbound = await self.get_inbound(inbound_id)
+        if not inbound:
+            return None
         
+        settings = json.loads(inbound.get("settings") or "{}")
+        parsed = {
+            "inbound": inbound,
+            "stream_settings": json.loads(inbound.get("streamSettings") or "{}"),
+            "clients": {c.get("email"): c for c in settings.get("clients", [])}
+        }
+        self._parsed_inbounds[inbound_id] = (time.monotonic(), parsed)
+        return parsed
+    
+    async def get_client_links(self, inbound_id: int, email: str, address: str = None) -> dict:
+        """ساخت لینک کانفیگ و لینک اشتراک با یک بار دریافت inbound"""
+        parsed = await self._get_parsed_inbound(inbound_id)
+        if not parsed:
+            return {"success": False, "msg": "Inbound not found"}
+        
+        client = parsed["clients"].get(email)
         if not client:
-            return ""
+            return {"success": False, "msg": "Client not found"}
         
-        return f"{self.base_url}/sub/{client.get('subId', '')}"
+        return {
+            "success": True,
+            "client": client,
+            "inbound_remark": parsed["inbound"].get("remark", ""),
+            "config_link": self._build_config_link(parsed, client, address),
+            "sub_link": f"{self.base_url}/sub/{client.get('subId', '')}"
+        }
+    
+    async def get_subscription_link(self, inbound_id: int, email: str) -> str:
+        """ساخت لینک اشتراک"""
+        links = await self.get_client_links(inbound_id, email)
+        return links.get("sub_link", "")
     
     async def get_config_link(self, inbound_id: int, email: str, address: str = None) -> str:
         """ساخت لینک کامل کانفیگ (vless://, vmess://, trojan://)"""
-        inbound = await self.get_inbound(inbound_id)
-        if not inbound:
-            return ""
-        
-        # پیدا کردن کلاینت
-        settings = json.loads(inbound.get("settings", "{}"))
-        clients = settings.get("clients", [])
-        
-        client = None
-        for c in clients:
-            if c.get("email") == email:
-                client = c
-                break
-        
-        if not client:
-            return ""
-        
+        links = await self.get_client_links(inbound_id, email, address)
+        return links.get("config_link", "")
+    
+    def _build_config_link(self, parsed: dict, client: dict, address: str = None) -> str:
+        """ساخت لینک کانفیگ از inbound پارس شده"""
+        inbound = parsed["inbound"]
         protocol = inbound.get("protocol", "vless")
         port = inbound.get("port", 443)
         remark = inbound.get("remark", "")
@@ -333,10 +965,10 @@ class Panel3XUI:
         if not address:
             # استخراج از URL پنل
             from urllib.parse import urlparse
-            parsed = urlparse(self.base_url)
-            address = parsed.hostname
+            parsed_url = urlparse(self.base_url)
+            address = parsed_url.hostname
         
-        stream_settings = json.loads(inbound.get("streamSettings", "{}"))
+        stream_settings = parsed["stream_settings"]
         network = stream_settings.get("network", "tcp")
         security = stream_settings.get("security", "none")
         
@@ -560,10 +1192,132 @@ class Panel3XUI:
         return f"trojan://{password}@{address}:{port}?{params_str}#{quote(fragment)}"
 
 
-# تابع کمکی برای استفاده ساده
-async def get_panel() -> Panel3XUI:
-    """ایجاد و برگرداندن نمونه پنل"""
-    panel = Panel3XUI()
+# ==================== نمونه مشترک پنل ====================
+
+# یک نمونه برای کل پروسه - همه هندلرها و scheduler از همین استفاده می‌کنند
+# نمونه‌های مشترک پنل‌ها: panel_id -> Panel3XUI
+_panels: dict[int, Panel3XUI] = {}
+_panel_lock = asyncio.Lock()
+
+
+async def _open_panel(node: dict) -> Panel3XUI:
+    panel = Panel3XUI(node["url"], node["username"], node["password"],
+                      panel_id=node["id"], name=node["name"])
+    panel.is_active = bool(node["is_active"])
     await panel.create_session()
-    await panel.login()
+    await panel.ensure_login()
+    return panel
+
+
+async def init_panel() -> list:
+    """ایجاد نمونه مشترک همه پنل‌های ثبت شده (در post_init و پس از تغییر پنل‌ها فراخوانی می‌شود)
+    
+    پنل اصلی (شناسه 1) همیشه از PANEL_URL تنظیمات ساخته می‌شود.
+    """
+    await set_default_panel_node(PANEL_URL, PANEL_USERNAME, PANEL_PASSWORD)
+    nodes = await get_panel_nodes(active_only=False)
+    
+    async with _panel_lock:
+        missing = []
+        for node in nodes:
+            panel = _panels.get(node["id"])
+            if (panel is None or panel.session is None or panel.session.closed
+                    or panel.base_url != node["url"]):
+                missing.append(node)
+            else:
+                panel.is_active = bool(node["is_active"])
+        
+        # لاگین همزمان به همه نودها
+        for panel in await asyncio.gather(*(_open_panel(node) for node in missing)):
+            old = _panels.get(panel.panel_id)
+            if old is not None:
+                await old.close_session()
+            _panels[panel.panel_id] = panel
+    return get_panels()
+
+
+async def get_panel(panel_id: int = 1) -> Panel3XUI:
+    """برگرداندن نمونه مشترک یک پنل (در صورت نبود، ساخته می‌شود)"""
+    panel = _panels.get(panel_id)
+    if panel is not None and panel.session is not None and not panel.session.closed:
+        return panel
+    
+    if not _panels:
+        await init_panel()
+        if panel_id in _panels:
+            return _panels[panel_id]
+    
+    node = await get_panel_node(panel_id)
+    if node is None:
+        raise ValueError(f"Panel {panel_id} not found")
+    async with _panel_lock:
+        panel = _panels.get(panel_id)
+        if panel is None or panel.session is None or panel.session.closed:
+            panel = await _open_panel(node)
+            _panels[panel_id] = panel
     return panel
+
+
+def get_panels(active_only: bool = False) -> list:
+    """نمونه‌های باز پنل‌ها به ترتیب شناسه (active_only: فقط پنل‌هایی که کانفیگ جدید می‌گیرند)"""
+    return [
+        _panels[panel_id] for panel_id in sorted(_panels)
+        if _panels[panel_id].is_active or not active_only
+    ]
+
+
+async def get_all_inbounds(allow_stale: bool = False) -> list:
+    """inboundهای همه پنل‌های فعال به صورت همزمان - لیست (پنل، inboundها)
+
+    پنلی که در دسترس نباشد نادیده گرفته می‌شود.
+    """
+    panels = get_panels(active_only=True)
+    if not _panels:
+        panels = [panel for panel in await init_panel() if panel.is_active]
+    
+    results = await asyncio.gather(
+        *(panel.get_inbounds(allow_stale=allow_stale) for panel in panels),
+        return_exceptions=True
+    )
+    panel_inbounds = []
+    for panel, inbounds in zip(panels, results):
+        if isinstance(inbounds, Exception):
+            print(f"Get inbounds error ({panel.name}): {inbounds}")
+        elif inbounds:
+            panel_inbounds.append((panel, inbounds))
+    return panel_inbounds
+
+
+async def pick_inbound(allow_stale: bool = True) -> Optional[tuple[Panel3XUI, dict]]:
+    """انتخاب کم‌بارترین inbound فعال از همه پنل‌ها بر اساس تعداد کلاینت و ترافیک اخیر
+
+    از کش لیست inboundها استفاده می‌کند و درخواست اضافه‌ای به پنل نمی‌فرستد.
+    """
+    candidates = []
+    for panel, inbounds in await get_all_inbounds(allow_stale=allow_stale):
+        for inbound in inbounds:
+            # inbound خالی socks/http/... کم‌بارترین است ولی لینک برایش ساخته نمی‌شود
+            if not inbound.get("enable", True) or inbound.get("protocol") not in LINK_PROTOCOLS:
+                continue
+            clients, rate = panel.get_inbound_load(inbound)
+            candidates.append((panel, inbound, clients, rate))
+    
+    if not candidates:
+        return None
+    
+    # امتیاز نرمال شده: سهم از بیشترین تعداد کلاینت + سهم از بیشترین ترافیک اخیر
+    max_clients = max(c[2] for c in candidates) or 1
+    max_rate = max(c[3] for c in candidates) or 1
+    panel, inbound, _, _ = min(
+        candidates,
+        key=lambda c: c[2] / max_clients + PLACEMENT_TRAFFIC_WEIGHT * c[3] / max_rate
+    )
+    return panel, inbound
+
+
+async def close_panel():
+    """بستن نمونه‌های مشترک پنل‌ها (در post_shutdown فراخوانی می‌شود)"""
+    async with _panel_lock:
+        for panel in _panels.values():
+            await panel.close_session()
+        _panels.clear()
@@ -16,7 +16,8 @@ from telegram import Update
 from telegram.ext import Application, ContextTypes
 
 from config import *
-from database import init_db, add_user
+from database import init_db, close_db, add_user
+from api import init_panel, close_panel
 from handlers.user import get_user_handlers
 from handlers.admin import get_admin_handlers
 from scheduler import init_scheduler, stop_scheduler
@@ -52,6 +53,9 @@ async def post_init(application: Application):
     # افزودن ادمین اصلی اگر وجود نداشته باشد
     await add_user(SUDO_ADMIN_ID, is_admin=True, is_sudo=True, traffic_limit_gb=99999)
     
+    logger.info("Initializing panel client...")
+    await init_panel()
+    
     logger.info("Initializing scheduler...")
     init_scheduler(application.bot)
     
@@ -72,6 +76,10 @@ async def post_shutdown(application: Application):
     """اجرا قبل از خاموش شدن"""
     logger.info("Shutting down scheduler...")
     stop_scheduler()
+    logger.info("Closing panel client...")
+    await close_panel()
+    logger.info("Closing database...")
+    await close_db()
     logger.info("Bot shutdown complete.")
 
 
@@ -15,17 +15,30 @@ if _parent_dir not in sys.path:
 
 # بارگذاری تنظیمات
 try:
-    # اول سعی می‌کنیم از config.local بارگذاری کنیم
+    # مقادیر پیش‌فرض همیشه از config بارگذاری می‌شوند تا تنظیمات جدید
+    # در فایل‌های local قدیمی هم مقدار داشته باشند
+    from .config import *
+except ImportError:
+    print("❌ فایل تنظیمات یافت نشد!")
+    sys.exit(1)
+
+_DEFAULT_MESSAGES = MESSAGES
+
+try:
+    # سپس مقادیر config.local روی پیش‌فرض‌ها نوشته می‌شوند
     from .local import *
     print("✅ تنظیمات از config.local بارگذاری شد")
 except ImportError:
-    try:
-        # اگر config.local موجود نبود، از config بارگذاری می‌کنیم
-        from .config import *
-        print("⚠️ تنظیمات از config.py بارگذاری شد (برای توسعه)")
-    except ImportError:
-        print("❌ فایل تنظیمات یافت نشد!")
-        sys.exit(1)
+    print("⚠️ تنظیمات از config.py بارگذاری شد (برای توسعه)")
+
+# MESSAGES فایل local (کپی کامل config.py قدیمی) جایگزین کل دیکشنری می‌شود؛
+# پیام‌های جدید از پیش‌فرض‌ها اضافه می‌شوند
+MESSAGES = {**_DEFAULT_MESSAGES, **MESSAGES}
+
+# سطوح هشدار از مقدار نهایی ALERT_THRESHOLD_PERCENT (شاید تغییر یافته در local) ساخته می‌شوند
+ALERT_THRESHOLD_TIERS = sorted({ALERT_THRESHOLD_PERCENT} | {
+    tier for tier in ALERT_ESCALATION_TIERS if tier > ALERT_THRESHOLD_PERCENT
+})
 
 # بررسی تنظیمات ضروری (فقط چک کردن وجود مقدار)
 required_settings = ['BOT_TOKEN', 'SUDO_ADMIN_ID', 'PANEL_URL', 'PANEL_PASSWORD']
@@ -12,16 +12,64 @@ PANEL_URL = "https://your-panel.com:2053"  # آدرس کامل پنل
 PANEL_USERNAME = "admin"  # نام کاربری پنل
 PANEL_PASSWORD = "YOUR_PANEL_PASSWORD"  # رمز عبور پنل
 
+# تنظیمات اتصال به پنل (connection pool مشترک)
+PANEL_POOL_SIZE = 20  # حداکثر کل اتصال‌های همزمان
+PANEL_POOL_PER_HOST = 10  # حداکثر اتصال همزمان به هر هاست
+PANEL_KEEPALIVE_SECONDS = 60  # مدت نگهداری اتصال بیکار (ثانیه)
+PANEL_REQUEST_TIMEOUT = 30  # تایم‌اوت هر درخواست (ثانیه)
+PANEL_PERSIST_SESSION = True  # ذخیره کوکی پنل در دیتابیس برای استفاده بعد از ری‌استارت
+
+# کش لیست inboundها
+INBOUNDS_CACHE_TTL_SECONDS = 60  # مدت تازه بودن کش (0 = بدون کش)
+INBOUNDS_CACHE_STALE_SECONDS = 600  # تا این مدت، کش قدیمی نمایش داده و در پس‌زمینه بروز می‌شود
+INBOUND_MEMO_TTL_SECONDS = 30  # نگهداری inbound پارس شده برای ساخت لینک
+CLIENT_INDEX_TTL_SECONDS = 900  # اعتبار ایندکس ایمیل/UUID کلاینت‌ها (با هر تغییر از طریق ربات بروز می‌شود)
+
+# ترافیک تعداد کمی کلاینت با درخواست‌های جداگانه getClientTraffics گرفته می‌شود
+# (به جای دانلود کل لیست inboundها) - بیش از این تعداد، یک دریافت لیست
+CLIENT_TRAFFIC_DIRECT_MAX = 20
+CLIENT_TRAFFIC_CONCURRENCY = 5  # تعداد درخواست همزمان getClientTraffics
+
 # تنظیمات دیتابیس
 import os
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATABASE_PATH = os.path.join(BASE_DIR, "data.db")
+DB_CACHE_SIZE_KB = 16384  # حافظه کش صفحات SQLite (کیلوبایت)
+DB_MMAP_SIZE_MB = 64  # حجم memory-mapped I/O (مگابایت)
+DB_STATEMENT_CACHE_SIZE = 256  # تعداد کوئری‌های آماده نگهداری شده
+DB_BACKFILL_BATCH_SIZE = 5000  # تعداد ردیف در هر دسته backfill هنگام migration
+DB_ONLINE_BACKFILL = False  # اجرای backfill در پس‌زمینه (ربات بدون انتظار بالا می‌آید)
 
 # تنظیمات زمان‌بندی
-TRAFFIC_CHECK_INTERVAL_HOURS = 9  # هر 9 ساعت چک شود
+TRAFFIC_CHECK_INTERVAL_HOURS = 9  # فاصله همگام‌سازی کامل (دریافت لیست inboundهای همه پنل‌ها)
+# بین همگام‌سازی‌های کامل فقط کلاینت‌های کاربران پرمصرف نزدیک سطح هشدار بعدی بررسی می‌شوند
+TRAFFIC_CHECK_MIN_MINUTES = 15  # حداقل فاصله چک کاربران پرمصرف
+ARCHIVE_INTERVAL_HOURS = 24  # انتقال کانفیگ‌های حذف شده به آرشیو هر 24 ساعت
+ARCHIVE_BATCH_SIZE = 500  # تعداد کانفیگ در هر تراکنش آرشیو
+USER_TRAFFIC_REFRESH_COOLDOWN_SECONDS = 60  # فاصله مجاز بین بروزرسانی دستی ترافیک هر کاربر
+
+# سابقه مصرف کانفیگ‌ها: نمونه‌های خام به سطل‌های ساعتی و سپس روزانه تجمیع می‌شوند
+USAGE_ROLLUP_INTERVAL_HOURS = 1  # فاصله اجرای job تجمیع
+USAGE_RAW_RETENTION_HOURS = 48  # نگهداری نمونه‌های خام (هر همگام‌سازی)
+USAGE_HOURLY_RETENTION_DAYS = 30  # نگهداری سطل‌های ساعتی
+USAGE_DAILY_RETENTION_DAYS = 365  # نگهداری سطل‌های روزانه (0 = همیشه)
 
 # درصد هشدار - وقتی به این درصد از حد مجاز رسید، هشدار ارسال شود
 ALERT_THRESHOLD_PERCENT = 80
+# سطوح هشدار بعد از ALERT_THRESHOLD_PERCENT - هر سطح تا پایین آمدن مصرف یا تغییر حد مجاز
+# فقط یک بار ارسال می‌شود (ALERT_THRESHOLD_TIERS بعد از بارگذاری local از این دو ساخته می‌شود)
+ALERT_ESCALATION_TIERS = [90, 100]
+
+# محدودیت ارسال پیام‌های گروهی (تلگرام: حدود 30 پیام در ثانیه، 1 پیام در ثانیه برای هر چت)
+NOTIFY_RATE_PER_SECOND = 25
+NOTIFY_PER_CHAT_INTERVAL_SECONDS = 1
+NOTIFY_WORKERS = 8  # تعداد ارسال همزمان
+NOTIFY_MAX_RETRIES = 3  # تلاش مجدد برای هر پیام
+
+# غیرفعال‌سازی خودکار کلاینت‌های کاربران بیش از حد مجاز یا کانفیگ‌های منقضی
+ENFORCE_QUOTAS = True
+ENFORCE_BATCH_SIZE = 50  # تعداد کلاینت در هر دسته (ثبت در دیتابیس پس از هر دسته)
+ENFORCE_CONCURRENCY = 5  # تعداد درخواست همزمان به پنل
 
 # پیش‌فرض حد ترافیک برای کاربران جدید (گیگابایت)
 DEFAULT_TRAFFIC_LIMIT_GB = 50
@@ -30,6 +78,13 @@ DEFAULT_TRAFFIC_LIMIT_GB = 50
 DEFAULT_CONFIG_TRAFFIC_GB = 10  # حجم پیش‌فرض کانفیگ
 DEFAULT_CONFIG_DAYS = 30  # روزهای پیش‌فرض انقضا
 
+# ساخت گروهی کانفیگ
+BULK_CREATE_MAX_COUNT = 200  # حداکثر تعداد کانفیگ در هر ساخت گروهی
+BULK_CREATE_CHUNK_SIZE = 50  # تعداد کلاینت در هر درخواست به پنل
+
+# انتخاب خودکار سرور: وزن ترافیک اخیر نسبت به تعداد کلاینت در امتیاز بار inbound
+PLACEMENT_TRAFFIC_WEIGHT = 1.0
+
 # پیام‌های ربات
 MESSAGES = {
     "welcome": "👋 درود دوست عزیزم!\n\n🤖 به بات Control Reseller 3X-UI خوش اومدی\n\n📌 از دکمه‌ها استفاده کن\n\n👨‍💻 ساخته شده توسط: @wingsbotCr",
@@ -42,4 +97,8 @@ MESSAGES = {
     "error": "❌ خطایی رخ داد. لطفاً دوباره تلاش کنید.",
     "alert_near_limit": "⚠️ هشدار: شما به {percent}% از حد مجاز ترافیک خود رسیده‌اید!\nمصرفی: {used} GB از {limit} GB",
     "admin_alert": "🔔 هشدار ادمین:\nکاربر {user_id} به {percent}% از حد مجاز رسیده است.",
+    "admin_alert_digest": "🔔 هشدار ادمین:\n{count} کاربر به حد هشدار ترافیک رسیده‌اند:",
+    "configs_suspended": "⛔ {count} کانفیگ شما به دلیل اتمام حجم مجاز یا انقضا غیرفعال شد.",
+    "configs_resumed": "✅ {count} کانفیگ شما دوباره فعال شد.",
+    "admin_alert_line": "• کاربر {user_id}: {percent}% ({used} از {limit} GB)",
 }
@@ -1,51 +1,120 @@
 # مدیریت دیتابیس SQLite
 
+import asyncio
 import aiosqlite
+from contextlib import asynccontextmanager
 from datetime import datetime
-from config import DATABASE_PATH
+from config import (
+    DATABASE_PATH, DB_CACHE_SIZE_KB, DB_MMAP_SIZE_MB, DB_STATEMENT_CACHE_SIZE
+)
+from models import User, Config, BYTES_PER_GB
 
 
-async def init_db():
-    """ایجاد جداول دیتابیس"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # جدول کاربران
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                telegram_id INTEGER PRIMARY KEY,
-                is_admin BOOLEAN DEFAULT 0,
-                is_sudo BOOLEAN DEFAULT 0,
-                traffic_limit_gb REAL DEFAULT 50,
-                is_blocked BOOLEAN DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # جدول کانفیگ‌ها
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS configs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                owner_telegram_id INTEGER NOT NULL,
-                panel_client_email TEXT NOT NULL,
-                inbound_id INTEGER NOT NULL,
-                traffic_limit_gb REAL NOT NULL,
-                traffic_used_gb REAL DEFAULT 0,
-                expiry_time INTEGER NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_deleted BOOLEAN DEFAULT 0,
-                deleted_traffic_gb REAL DEFAULT 0,
-                FOREIGN KEY (owner_telegram_id) REFERENCES users(telegram_id)
-            )
-        """)
-        
-        # جدول تنظیمات
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
+# اتصال مشترک و ماندگار به دیتابیس برای کل پروسه
+_db: aiosqlite.Connection | None = None
+_db_open_lock = asyncio.Lock()
+# تراکنش‌های نوشتن روی اتصال مشترک باید پشت سر هم اجرا شوند
+_write_lock = asyncio.Lock()
+
+
+async def get_db() -> aiosqlite.Connection:
+    """برگرداندن اتصال مشترک دیتابیس (در صورت نبود، باز می‌شود)"""
+    global _db
+    if _db is not None:
+        return _db
+    
+    async with _db_open_lock:
+        if _db is None:
+            db = await aiosqlite.connect(
+                DATABASE_PATH, cached_statements=DB_STATEMENT_CACHE_SIZE
             )
-        """)
-        
-        await db.commit()
+            db.row_factory = aiosqlite.Row
+            await db.execute("PRAGMA journal_mode = WAL")
+            await db.execute("PRAGMA synchronous = NORMAL")
+            await db.execute(f"PRAGMA cache_size = -{int(DB_CACHE_SIZE_KB)}")
+            await db.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE_MB) * 1024 * 1024}")
+            await db.execute("PRAGMA temp_store = MEMORY")
+            _db = db
+    return _db
+
+
+@asynccontextmanager
+async def transaction():
+    """تراکنش نوشتن روی اتصال مشترک - در پایان commit و در صورت خطا rollback می‌شود"""
+    db = await get_db()
+    async with _write_lock:
+        # sqlite3 پایتون قبل از DDL تراکنش باز نمی‌کند؛ بدون BEGIN هر CREATE/ALTER جدا commit می‌شود
+        if not db.in_transaction:
+            await db.execute("BEGIN")
+        try:
+            yield db
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+
+
+async def close_db():
+    """بستن اتصال مشترک دیتابیس"""
+    global _db
+    from migrations import cancel_backfills
+    await cancel_backfills()
+    if _db is not None:
+        # بروزرسانی آمار برنامه‌ریز کوئری برای ایندکس‌ها
+        await _db.execute("PRAGMA optimize")
+        await _db.close()
+        _db = None
+
+
+# سهم هر کانفیگ از مصرف کاربر (بایت): فعال -> traffic_used_bytes، حذف شده -> deleted_traffic_bytes
+# users.used_traffic_bytes = مجموع سهم کانفیگ‌های جدول configs + archived_traffic_bytes
+_CONFIG_USAGE = (
+    "CASE WHEN {row}.is_deleted THEN {row}.deleted_traffic_bytes "
+    "ELSE {row}.traffic_used_bytes END"
+)
+
+
+async def init_db():
+    """ایجاد جداول دیتابیس و اجرای migrationها"""
+    from migrations import run_migrations
+    await run_migrations()
+
+
+# ==================== توابع تنظیمات ====================
+
+async def get_setting(key: str, default: str | None = None) -> str | None:
+    """دریافت مقدار یک تنظیم"""
+    db = await get_db()
+    async with db.execute(
+        "SELECT value FROM settings WHERE key = ?", (key,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        return row[0] if row else default
+
+
+async def set_setting(key: str, value: str) -> bool:
+    """ذخیره مقدار یک تنظیم"""
+    try:
+        async with transaction() as db:
+            await db.execute("""
+                INSERT INTO settings (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            """, (key, value))
+            return True
+    except Exception as e:
+        print(f"Error saving setting: {e}")
+        return False
+
+
+async def delete_setting(key: str) -> bool:
+    """حذف یک تنظیم"""
+    try:
+        async with transaction() as db:
+            await db.execute("DELETE FROM settings WHERE key = ?", (key,))
+            return True
+    except Exception as e:
+        print(f"Error deleting setting: {e}")
+        return False
 
 
 # ==================== توابع مربوط به کاربران ====================
@@ -53,39 +122,40 @@ async def init_db():
 async def add_user(telegram_id: int, is_admin: bool = False, is_sudo: bool = False, 
                    traffic_limit_gb: float = 50) -> bool:
     """افزودن کاربر جدید"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
-            await db.execute("""
-                INSERT OR IGNORE INTO users (telegram_id, is_admin, is_sudo, traffic_limit_gb)
-                VALUES (?, ?, ?, ?)
-            """, (telegram_id, is_admin, is_sudo, traffic_limit_gb))
-            await db.commit()
+    try:
+        async with transaction() as db:
+            await db.execute(f"""
+                INSERT OR IGNORE INTO users (telegram_id, is_admin, is_sudo, traffic_limit_gb,
+                                             used_traffic_bytes)
+                VALUES (?, ?, ?, ?, (
+                    SELECT COALESCE(SUM({_CONFIG_USAGE.format(row="configs")}), 0)
+                    FROM configs WHERE owner_telegram_id = ?
+                ))
+            """, (telegram_id, is_admin, is_sudo, traffic_limit_gb, telegram_id))
             return True
-        except Exception as e:
-            print(f"Error adding user: {e}")
-            return False
+    except Exception as e:
+        print(f"Error adding user: {e}")
+        return False
 
 
-async def get_user(telegram_id: int) -> dict | None:
+async def get_user(telegram_id: int) -> User | None:
     """دریافت اطلاعات کاربر"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+    db = await get_db()
+    async with db.execute(
+        "SELECT * FROM users WHERE telegram_id = ?", (telegram_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if row:
+            return User.from_row(row)
+        return None
 
 
 async def get_all_users() -> list:
     """دریافت لیست همه کاربران"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute("SELECT * FROM users") as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    db = await get_db()
+    async with db.execute("SELECT * FROM users") as cursor:
+        rows = await cursor.fetchall()
+        return User.from_rows(rows)
 
 
 async def update_user(telegram_id: int, **kwargs) -> bool:
@@ -96,16 +166,15 @@ async def update_user(telegram_id: int, **kwargs) -> bool:
     set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
     values = list(kwargs.values()) + [telegram_id]
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with transaction() as db:
             await db.execute(
                 f"UPDATE users SET {set_clause} WHERE telegram_id = ?", values
             )
-            await db.commit()
             return True
-        except Exception as e:
-            print(f"Error updating user: {e}")
-            return False
+    except Exception as e:
+        print(f"Error updating user: {e}")
+        return False
 
 
 async def block_user(telegram_id: int, blocked: bool = True) -> bool:
@@ -139,72 +208,93 @@ async def is_user_sudo(telegram_id: int) -> bool:
 # ==================== توابع مربوط به کانفیگ‌ها ====================
 
 async def add_config(owner_telegram_id: int, panel_client_email: str, inbound_id: int,
-                     traffic_limit_gb: float, expiry_time: int) -> int | None:
+                     traffic_limit_gb: float, expiry_time: int, panel_id: int = 1) -> int | None:
     """افزودن کانفیگ جدید"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with transaction() as db:
             cursor = await db.execute("""
                 INSERT INTO configs (owner_telegram_id, panel_client_email, inbound_id, 
-                                     traffic_limit_gb, expiry_time)
-                VALUES (?, ?, ?, ?, ?)
-            """, (owner_telegram_id, panel_client_email, inbound_id, traffic_limit_gb, expiry_time))
-            await db.commit()
+                                     traffic_limit_gb, expiry_time, panel_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (owner_telegram_id, panel_client_email, inbound_id, traffic_limit_gb,
+                  expiry_time, panel_id))
             return cursor.lastrowid
-        except Exception as e:
-            print(f"Error adding config: {e}")
-            return None
+    except Exception as e:
+        print(f"Error adding config: {e}")
+        return None
+
+
+async def add_configs(owner_telegram_id: int, panel_client_emails: list, inbound_id: int,
+                      traffic_limit_gb: float, expiry_time: int, panel_id: int = 1) -> int:
+    """افزودن گروهی کانفیگ‌ها در یک تراکنش"""
+    try:
+        async with transaction() as db:
+            await db.executemany("""
+                INSERT INTO configs (owner_telegram_id, panel_client_email, inbound_id, 
+                                     traffic_limit_gb, expiry_time, panel_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (owner_telegram_id, email, inbound_id, traffic_limit_gb, expiry_time, panel_id)
+                for email in panel_client_emails
+            ])
+            return len(panel_client_emails)
+    except Exception as e:
+        print(f"Error adding configs: {e}")
+        return 0
 
 
-async def get_config(config_id: int) -> dict | None:
+async def get_config(config_id: int) -> Config | None:
     """دریافت اطلاعات یک کانفیگ"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM configs WHERE id = ?", (config_id,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
-
-
-async def get_config_by_email(email: str) -> dict | None:
+    db = await get_db()
+    async with db.execute(
+        "SELECT * FROM configs WHERE id = ?", (config_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if row:
+            return Config.from_row(row)
+        return None
+
+
+async def get_config_by_email(email: str) -> Config | None:
     """دریافت کانفیگ با ایمیل"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM configs WHERE panel_client_email = ?", (email,)
-        ) as cursor:
-            row = await cursor.fetchone()
-            if row:
-                return dict(row)
-            return None
+    db = await get_db()
+    async with db.execute(
+        "SELECT * FROM configs WHERE panel_client_email = ?", (email,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        if row:
+            return Config.from_row(row)
+        return None
 
 
 async def get_user_configs(telegram_id: int, include_deleted: bool = False) -> list:
-    """دریافت کانفیگ‌های یک کاربر"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        
-        if include_deleted:
-            query = "SELECT * FROM configs WHERE owner_telegram_id = ?"
-        else:
-            query = "SELECT * FROM configs WHERE owner_telegram_id = ? AND is_deleted = 0"
-        
-        async with db.execute(query, (telegram_id,)) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    """دریافت کانفیگ‌های یک کاربر (با include_deleted شامل کانفیگ‌های آرشیو شده)"""
+    db = await get_db()
+    if include_deleted:
+        query = f"""
+            SELECT {_ARCHIVE_COLUMNS} FROM configs WHERE owner_telegram_id = ?
+            UNION ALL
+            SELECT {_ARCHIVE_COLUMNS} FROM configs_archive WHERE owner_telegram_id = ?
+            ORDER BY id
+        """
+        params = (telegram_id, telegram_id)
+    else:
+        query = "SELECT * FROM configs WHERE owner_telegram_id = ? AND is_deleted = 0"
+        params = (telegram_id,)
+    
+    async with db.execute(query, params) as cursor:
+        rows = await cursor.fetchall()
+        return Config.from_rows(rows)
 
 
 async def get_all_active_configs() -> list:
     """دریافت همه کانفیگ‌های فعال"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        db.row_factory = aiosqlite.Row
-        async with db.execute(
-            "SELECT * FROM configs WHERE is_deleted = 0"
-        ) as cursor:
-            rows = await cursor.fetchall()
-            return [dict(row) for row in rows]
+    db = await get_db()
+    async with db.execute(
+        "SELECT * FROM configs WHERE is_deleted = 0"
+    ) as cursor:
+        rows = await cursor.fetchall()
+        return Config.from_rows(rows)
 
 
 async def update_config(config_id: int, **kwargs) -> bool:
@@ -215,32 +305,132 @@ async def update_config(config_id: int, **kwargs) -> bool:
     set_clause = ", ".join([f"{k} = ?" for k in kwargs.keys()])
     values = list(kwargs.values()) + [config_id]
     
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        try:
+    try:
+        async with transaction() as db:
             await db.execute(
                 f"UPDATE configs SET {set_clause} WHERE id = ?", values
             )
-            await db.commit()
             return True
-        except Exception as e:
-            print(f"Error updating config: {e}")
-            return False
+    except Exception as e:
+        print(f"Error updating config: {e}")
+        return False
 
 
-async def update_config_traffic(config_id: int, traffic_used_gb: float) -> bool:
-    """بروزرسانی حجم مصرفی کانفیگ"""
-    return await update_config(config_id, traffic_used_gb=traffic_used_gb)
+async def update_config_traffic(config_id: int, traffic_used_bytes: int) -> bool:
+    """بروزرسانی حجم مصرفی کانفیگ (بایت)"""
+    return await update_config(config_id, traffic_used_bytes=traffic_used_bytes)
+
+
+async def get_active_configs_traffic() -> dict:
+    """ترافیک ذخیره شده کانفیگ‌های فعال: (پنل، ایمیل) -> (id، مالک، بایت مصرفی)"""
+    db = await get_db()
+    async with db.execute("""
+        SELECT panel_id, panel_client_email, id, owner_telegram_id, traffic_used_bytes
+        FROM configs WHERE is_deleted = 0
+    """) as cursor:
+        rows = await cursor.fetchall()
+        return {(row[0], row[1]): (row[2], row[3], row[4]) for row in rows}
+
+
+async def get_users_configs_traffic(telegram_ids: list) -> dict:
+    """ترافیک ذخیره شده کانفیگ‌های فعال کاربران مشخص - همان خروجی get_active_configs_traffic"""
+    telegram_ids = list(telegram_ids)
+    db = await get_db()
+    traffic = {}
+    for i in range(0, len(telegram_ids), 500):
+        batch = telegram_ids[i:i + 500]
+        async with db.execute(f"""
+            SELECT panel_id, panel_client_email, id, owner_telegram_id, traffic_used_bytes
+            FROM configs
+            WHERE is_deleted = 0 AND owner_telegram_id IN ({', '.join('?' * len(batch))})
+        """, batch) as cursor:
+            for row in await cursor.fetchall():
+                traffic[(row[0], row[1])] = (row[2], row[3], row[4])
+    return traffic
+
+
+async def update_configs_traffic(updates: list) -> int:
+    """بروزرسانی گروهی حجم مصرفی در یک تراکنش - updates: [(config_id, traffic_used_bytes)]"""
+    if not updates:
+        return 0
+    
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                "UPDATE configs SET traffic_used_bytes = ? WHERE id = ?",
+                [(traffic_used_bytes, config_id) for config_id, traffic_used_bytes in updates]
+            )
+            return len(updates)
+    except Exception as e:
+        print(f"Error updating configs traffic: {e}")
+        return 0
 
 
-async def delete_config(config_id: int, final_traffic_gb: float) -> bool:
+async def delete_config(config_id: int, final_traffic_bytes: int) -> bool:
     """حذف کانفیگ (نرم) - حفظ حجم مصرفی"""
     return await update_config(
         config_id, 
         is_deleted=True, 
-        deleted_traffic_gb=final_traffic_gb
+        deleted_traffic_bytes=final_traffic_bytes
     )
 
 
+# ستون‌های مشترک configs و configs_archive
+_ARCHIVE_COLUMNS = (
+    "id, owner_telegram_id, panel_client_email, inbound_id, traffic_limit_gb, "
+    "traffic_used_bytes, expiry_time, created_at, is_deleted, deleted_traffic_bytes, panel_id"
+)
+
+
+async def archive_deleted_configs(batch_size: int = 500) -> int:
+    """انتقال کانفیگ‌های حذف شده به جدول آرشیو - هر دسته در یک تراکنش
+    
+    مصرف کانفیگ‌ها به archived_traffic_bytes کاربر منتقل می‌شود تا کل مصرف تغییر نکند.
+    """
+    archived = 0
+    try:
+        while True:
+            async with transaction() as db:
+                async with db.execute("""
+                    SELECT MAX(id), COUNT(*) FROM (
+                        SELECT id FROM configs WHERE is_deleted = 1 ORDER BY id LIMIT ?
+                    )
+                """, (batch_size,)) as cursor:
+                    upper, count = await cursor.fetchone()
+                if not count:
+                    return archived
+                
+                await db.execute(f"""
+                    INSERT OR REPLACE INTO configs_archive ({_ARCHIVE_COLUMNS})
+                    SELECT {_ARCHIVE_COLUMNS} FROM configs
+                    WHERE is_deleted = 1 AND id <= ?
+                """, (upper,))
+                
+                # قبل از حذف (که تریگر سهم را از used_traffic_bytes کم می‌کند) به هر دو ستون اضافه می‌شود
+                await db.execute("""
+                    UPDATE users
+                    SET archived_traffic_bytes = archived_traffic_bytes + moved.total,
+                        used_traffic_bytes = used_traffic_bytes + moved.total
+                    FROM (
+                        SELECT owner_telegram_id, SUM(deleted_traffic_bytes) AS total
+                        FROM configs WHERE is_deleted = 1 AND id <= ?
+                        GROUP BY owner_telegram_id
+                    ) AS moved
+                    WHERE users.telegram_id = moved.owner_telegram_id
+                """, (upper,))
+                
+                await db.execute(
+                    "DELETE FROM configs WHERE is_deleted = 1 AND id <= ?", (upper,)
+                )
+                archived += count
+            
+            # فرصت اجرا به سایر درخواست‌ها بین دسته‌ها
+            await asyncio.sleep(0)
+    except Exception as e:
+        print(f"Error archiving configs: {e}")
+        return archived
+
+
 async def extend_config(config_id: int, new_expiry_time: int, 
                         additional_traffic_gb: float = 0) -> bool:
     """تمدید کانفیگ"""
@@ -256,90 +446,383 @@ async def extend_config(config_id: int, new_expiry_time: int,
     )
 
 
+# ==================== پنل‌ها (نودها) ====================
+
+async def get_panel_nodes(active_only: bool = True) -> list:
+    """لیست پنل‌های ثبت شده"""
+    query = "SELECT * FROM panels"
+    if active_only:
+        query += " WHERE is_active = 1"
+    query += " ORDER BY id"
+    
+    db = await get_db()
+    async with db.execute(query) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def get_panel_node(panel_id: int) -> dict | None:
+    """اطلاعات یک پنل"""
+    db = await get_db()
+    async with db.execute("SELECT * FROM panels WHERE id = ?", (panel_id,)) as cursor:
+        row = await cursor.fetchone()
+        return dict(row) if row else None
+
+
+async def add_panel_node(name: str, url: str, username: str, password: str) -> int | None:
+    """ثبت پنل جدید"""
+    try:
+        async with transaction() as db:
+            cursor = await db.execute("""
+                INSERT INTO panels (name, url, username, password) VALUES (?, ?, ?, ?)
+            """, (name, url.rstrip("/"), username, password))
+            return cursor.lastrowid
+    except Exception as e:
+        print(f"Error adding panel: {e}")
+        return None
+
+
+async def set_default_panel_node(url: str, username: str, password: str) -> bool:
+    """ثبت پنل اصلی (شناسه 1) از تنظیمات - کانفیگ‌های قدیمی روی این پنل هستند"""
+    try:
+        async with transaction() as db:
+            await db.execute("""
+                INSERT INTO panels (id, name, url, username, password) VALUES (1, 'main', ?, ?, ?)
+                ON CONFLICT(id) DO UPDATE SET
+                    url = excluded.url,
+                    username = excluded.username,
+                    password = excluded.password
+            """, (url.rstrip("/"), username, password))
+            return True
+    except Exception as e:
+        print(f"Error saving default panel: {e}")
+        return False
+
+
+async def set_panel_node_active(panel_id: int, is_active: bool) -> bool:
+    """فعال/غیرفعال کردن یک پنل"""
+    try:
+        async with transaction() as db:
+            await db.execute(
+                "UPDATE panels SET is_active = ? WHERE id = ?", (is_active, panel_id)
+            )
+            return True
+    except Exception as e:
+        print(f"Error updating panel: {e}")
+        return False
+
+
+# ==================== غیرفعال‌سازی خودکار ====================
+
+# کانفیگی که مالکش از حد مجاز گذشته یا زمانش تمام شده باید در پنل غیرفعال باشد
+_OVER_QUOTA = f"""
+    ((u.traffic_limit_gb > 0
+      AND u.used_traffic_bytes >= CAST(u.traffic_limit_gb * {BYTES_PER_GB} AS INTEGER))
+     OR (c.expiry_time > 0 AND c.expiry_time <= ?))
+"""
+
+
+async def get_configs_to_suspend(now: int, owner_telegram_id: int = None) -> list:
+    """کانفیگ‌های فعالی که باید در پنل غیرفعال شوند"""
+    return await _enforcement_configs(f"c.is_suspended = 0 AND {_OVER_QUOTA}",
+                                      now, owner_telegram_id)
+
+
+async def get_configs_to_resume(now: int, owner_telegram_id: int = None) -> list:
+    """کانفیگ‌های غیرفعال شده‌ای که دیگر دلیلی برای غیرفعال بودن ندارند"""
+    return await _enforcement_configs(f"c.is_suspended = 1 AND NOT {_OVER_QUOTA}",
+                                      now, owner_telegram_id)
+
+
+async def _enforcement_configs(condition: str, now: int, owner_telegram_id: int = None) -> list:
+    query = f"""
+        SELECT c.id, c.owner_telegram_id, c.panel_client_email, c.inbound_id, c.panel_id
+        FROM configs c JOIN users u ON u.telegram_id = c.owner_telegram_id
+        WHERE c.is_deleted = 0 AND {condition}
+    """
+    params = (now,)
+    if owner_telegram_id is not None:
+        query += " AND c.owner_telegram_id = ?"
+        params += (owner_telegram_id,)
+    
+    db = await get_db()
+    async with db.execute(query, params) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+async def set_configs_suspended(config_ids: list, suspended: bool) -> int:
+    """ثبت وضعیت غیرفعال‌سازی چند کانفیگ در یک تراکنش"""
+    if not config_ids:
+        return 0
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                "UPDATE configs SET is_suspended = ? WHERE id = ?",
+                [(suspended, config_id) for config_id in config_ids]
+            )
+            return len(config_ids)
+    except Exception as e:
+        print(f"Error updating config suspension: {e}")
+        return 0
+
+
 # ==================== توابع آماری ====================
 
-async def get_user_total_traffic(telegram_id: int) -> float:
-    """محاسبه کل ترافیک مصرفی یک کاربر"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # جمع ترافیک کانفیگ‌های فعال
-        async with db.execute("""
-            SELECT COALESCE(SUM(traffic_used_gb), 0) as active_traffic
-            FROM configs 
-            WHERE owner_telegram_id = ? AND is_deleted = 0
-        """, (telegram_id,)) as cursor:
-            row = await cursor.fetchone()
-            active_traffic = row[0] if row else 0
-        
-        # جمع ترافیک کانفیگ‌های حذف شده
-        async with db.execute("""
-            SELECT COALESCE(SUM(deleted_traffic_gb), 0) as deleted_traffic
-            FROM configs 
-            WHERE owner_telegram_id = ? AND is_deleted = 1
-        """, (telegram_id,)) as cursor:
-            row = await cursor.fetchone()
-            deleted_traffic = row[0] if row else 0
-        
-        return active_traffic + deleted_traffic
-
-
-async def get_user_remaining_traffic(telegram_id: int) -> float:
-    """محاسبه ترافیک باقیمانده کاربر"""
+async def get_user_total_traffic(telegram_id: int) -> int:
+    """کل ترافیک مصرفی یک کاربر به بایت (از ستون تجمیعی users.used_traffic_bytes)"""
+    db = await get_db()
+    async with db.execute(
+        "SELECT used_traffic_bytes FROM users WHERE telegram_id = ?", (telegram_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+        return max(0, row[0] or 0) if row else 0
+
+
+async def get_user_remaining_traffic(telegram_id: int) -> int:
+    """محاسبه ترافیک باقیمانده کاربر (بایت)"""
     user = await get_user(telegram_id)
     if not user:
         return 0
     
-    total_used = await get_user_total_traffic(telegram_id)
-    return max(0, user["traffic_limit_gb"] - total_used)
+    total_used = max(0, user.get("used_traffic_bytes") or 0)
+    return max(0, int(user["traffic_limit_gb"] * BYTES_PER_GB) - total_used)
 
 
 async def get_overall_stats() -> dict:
     """دریافت آمار کلی"""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        # تعداد کاربران
-        async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-            total_users = (await cursor.fetchone())[0]
-        
-        # تعداد کانفیگ‌های فعال
-        async with db.execute(
-            "SELECT COUNT(*) FROM configs WHERE is_deleted = 0"
-        ) as cursor:
-            active_configs = (await cursor.fetchone())[0]
-        
-        # کل ترافیک مصرفی
-        async with db.execute("""
-            SELECT COALESCE(SUM(traffic_used_gb), 0) + 
-                   COALESCE((SELECT SUM(deleted_traffic_gb) FROM configs WHERE is_deleted = 1), 0)
-            FROM configs WHERE is_deleted = 0
-        """) as cursor:
-            total_traffic = (await cursor.fetchone())[0]
-        
-        return {
-            "total_users": total_users,
-            "active_configs": active_configs,
-            "total_traffic_gb": round(total_traffic, 2)
-        }
+    db = await get_db()
+    # تعداد کاربران
+    async with db.execute("SELECT COUNT(*) FROM users") as cursor:
+        total_users = (await cursor.fetchone())[0]
+    
+    # تعداد کانفیگ‌های فعال
+    async with db.execute(
+        "SELECT COUNT(*) FROM configs WHERE is_deleted = 0"
+    ) as cursor:
+        active_configs = (await cursor.fetchone())[0]
+    
+    # کل ترافیک مصرفی (شامل کانفیگ‌های آرشیو شده)
+    async with db.execute("""
+        SELECT COALESCE(SUM(traffic_used_bytes), 0) + 
+               COALESCE((SELECT SUM(deleted_traffic_bytes) FROM configs WHERE is_deleted = 1), 0) +
+               COALESCE((SELECT SUM(archived_traffic_bytes) FROM users), 0)
+        FROM configs WHERE is_deleted = 0
+    """) as cursor:
+        total_traffic = (await cursor.fetchone())[0]
+    
+    return {
+        "total_users": total_users,
+        "active_configs": active_configs,
+        "total_traffic_bytes": total_traffic
+    }
+
+
+async def get_users_usage(threshold_percent: float = None) -> list:
+    """مصرف، حد و درصد مصرف همه کاربران فعال با یک کوئری
+    
+    اگر threshold_percent داده شود، فقط کاربرانی که به این درصد رسیده‌اند برگردانده می‌شوند.
+    """
+    query = """
+        SELECT telegram_id, traffic_limit_gb, MAX(COALESCE(used_traffic_bytes, 0), 0)
+        FROM users
+        WHERE is_blocked = 0
+    """
+    params = ()
+    if threshold_percent is not None:
+        query += (" AND traffic_limit_gb > 0"
+                  f" AND used_traffic_bytes * 100.0 / (traffic_limit_gb * {BYTES_PER_GB}) >= ?")
+        params = (threshold_percent,)
+    
+    db = await get_db()
+    async with db.execute(query, params) as cursor:
+        rows = await cursor.fetchall()
+    
+    return [_usage_dict(telegram_id, limit, used) for telegram_id, limit, used in rows]
+
+
+def _usage_dict(telegram_id: int, limit: float, used: int) -> dict:
+    percent = used * 100 / (limit * BYTES_PER_GB) if limit > 0 else 0
+    return {
+        "telegram_id": telegram_id,
+        "used_bytes": used,
+        "limit_gb": limit,
+        "percent": round(percent, 1)
+    }
+
+
+async def get_users_alert_state(telegram_ids: list = None) -> list:
+    """مصرف و آخرین سطح هشدار کاربران فعال (None یعنی همه کاربران)"""
+    query = """
+        SELECT telegram_id, traffic_limit_gb, MAX(COALESCE(used_traffic_bytes, 0), 0), alert_tier
+        FROM users
+        WHERE is_blocked = 0
+    """
+    db = await get_db()
+    if telegram_ids is None:
+        batches = [()]
+    else:
+        telegram_ids = list(telegram_ids)
+        batches = [
+            tuple(telegram_ids[i:i + 500]) for i in range(0, len(telegram_ids), 500)
+        ]
+    
+    states = []
+    for batch in batches:
+        batch_query = query
+        if batch:
+            batch_query += f" AND telegram_id IN ({', '.join('?' * len(batch))})"
+        async with db.execute(batch_query, batch) as cursor:
+            for telegram_id, limit, used, alert_tier in await cursor.fetchall():
+                state = _usage_dict(telegram_id, limit, used)
+                state["alert_tier"] = alert_tier or 0
+                states.append(state)
+    return states
+
+
+async def set_users_alert_tier(tiers: list) -> int:
+    """ثبت سطح هشدار کاربران - tiers لیستی از (telegram_id, tier)"""
+    if not tiers:
+        return 0
+    try:
+        async with transaction() as db:
+            await db.executemany(
+                "UPDATE users SET alert_tier = ? WHERE telegram_id = ?",
+                [(tier, telegram_id) for telegram_id, tier in tiers]
+            )
+            return len(tiers)
+    except Exception as e:
+        print(f"Error updating alert tiers: {e}")
+        return 0
 
 
 async def get_users_near_limit(threshold_percent: float = 80) -> list:
     """یافتن کاربرانی که نزدیک حد مجاز هستند"""
-    users = await get_all_users()
-    near_limit = []
+    return await get_users_usage(threshold_percent)
+
+
+# ==================== سابقه اجرای jobها ====================
+
+async def add_job_run(job: str, started_at: int, duration_seconds: float,
+                      fetch_seconds: float = None, matched: int = 0, changed: int = 0,
+                      error: str = None, keep: int = 500) -> bool:
+    """ثبت یک اجرای job - فقط keep اجرای آخر هر job نگهداری می‌شود"""
+    try:
+        async with transaction() as db:
+            cursor = await db.execute("""
+                INSERT INTO job_runs (job, started_at, duration_seconds, fetch_seconds,
+                                      matched, changed, error)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (job, started_at, duration_seconds, fetch_seconds, matched, changed, error))
+            await db.execute(
+                "DELETE FROM job_runs WHERE job = ? AND id <= ?",
+                (job, cursor.lastrowid - keep)
+            )
+            return True
+    except Exception as e:
+        print(f"Error recording job run: {e}")
+        return False
+
+
+async def get_job_runs(job: str = None, limit: int = 10) -> list:
+    """آخرین اجراهای jobها (جدیدترین اول)"""
+    db = await get_db()
+    if job:
+        query = "SELECT * FROM job_runs WHERE job = ? ORDER BY id DESC LIMIT ?"
+        params = (job, limit)
+    else:
+        query = "SELECT * FROM job_runs ORDER BY id DESC LIMIT ?"
+        params = (limit,)
     
-    for user in users:
-        if user["is_blocked"]:
-            continue
+    async with db.execute(query, params) as cursor:
+        rows = await cursor.fetchall()
+        return [dict(row) for row in rows]
+
+
+# ==================== سابقه مصرف ====================
+
+# اندازه سطل‌های تجمیع سابقه مصرف (ثانیه)
+USAGE_HOUR = 3600
+USAGE_DAY = 86400
+
+
+async def rollup_usage_samples(now: int, raw_retention: int, hourly_retention: int,
+                               daily_retention: int = 0) -> dict:
+    """تجمیع نمونه‌های خام قدیمی در سطل‌های ساعتی، سطل‌های ساعتی قدیمی در سطل‌های روزانه
+    و حذف سطل‌های روزانه قدیمی‌تر از daily_retention (0 یعنی نگهداری همیشگی) - زمان‌ها به ثانیه
+    """
+    # فقط سطل‌های کامل تجمیع می‌شوند تا نمونه‌های یک سطل بین دو اجرا تقسیم نشوند
+    raw_cutoff = (now - raw_retention) // USAGE_HOUR * USAGE_HOUR
+    hourly_cutoff = (now - hourly_retention) // USAGE_DAY * USAGE_DAY
+    result = {"samples": 0, "hours": 0, "days_expired": 0}
+    
+    try:
+        async with transaction() as db:
+            await db.execute(f"""
+                INSERT INTO usage_rollups (config_id, resolution, bucket, bytes)
+                SELECT config_id, {USAGE_HOUR}, sampled_at / {USAGE_HOUR} * {USAGE_HOUR},
+                       SUM(delta_bytes)
+                FROM usage_samples WHERE sampled_at < ?
+                GROUP BY config_id, sampled_at / {USAGE_HOUR}
+                ON CONFLICT (config_id, resolution, bucket)
+                DO UPDATE SET bytes = bytes + excluded.bytes
+            """, (raw_cutoff,))
+            cursor = await db.execute(
+                "DELETE FROM usage_samples WHERE sampled_at < ?", (raw_cutoff,)
+            )
+            result["samples"] = cursor.rowcount
             
-        total_used = await get_user_total_traffic(user["telegram_id"])
-        limit = user["traffic_limit_gb"]
-        
-        if limit > 0:
-            percent = (total_used / limit) * 100
-            if percent >= threshold_percent:
-                near_limit.append({
-                    "telegram_id": user["telegram_id"],
-                    "used_gb": round(total_used, 2),
-                    "limit_gb": limit,
-                    "percent": round(percent, 1)
-                })
+            await db.execute(f"""
+                INSERT INTO usage_rollups (config_id, resolution, bucket, bytes)
+                SELECT config_id, {USAGE_DAY}, bucket / {USAGE_DAY} * {USAGE_DAY}, SUM(bytes)
+                FROM usage_rollups WHERE resolution = {USAGE_HOUR} AND bucket < ?
+                GROUP BY config_id, bucket / {USAGE_DAY}
+                ON CONFLICT (config_id, resolution, bucket)
+                DO UPDATE SET bytes = bytes + excluded.bytes
+            """, (hourly_cutoff,))
+            cursor = await db.execute(
+                f"DELETE FROM usage_rollups WHERE resolution = {USAGE_HOUR} AND bucket < ?",
+                (hourly_cutoff,)
+            )
+            result["hours"] = cursor.rowcount
+            
+            if daily_retention:
+                cursor = await db.execute(
+                    f"DELETE FROM usage_rollups WHERE resolution = {USAGE_DAY} AND bucket < ?",
+                    (now - daily_retention,)
+                )
+                result["days_expired"] = cursor.rowcount
+    except Exception as e:
+        print(f"Error rolling up usage history: {e}")
+    return result
+
+
+async def get_usage_history(config_ids: list, start: int, end: int,
+                            resolution: int = USAGE_HOUR) -> list:
+    """مصرف مجموع کانفیگ‌ها در بازه [start, end) به تفکیک سطل - [(شروع سطل، بایت)]
+    
+    داده‌های تجمیع شده با دقت کمتر (مثلاً روزانه در نمودار ساعتی) در شروع سطل خود می‌آیند.
+    """
+    config_ids = list(config_ids)
+    totals = {}
+    db = await get_db()
+    for i in range(0, len(config_ids), 500):
+        batch = tuple(config_ids[i:i + 500])
+        placeholders = ",".join("?" * len(batch))
+        query = f"""
+            SELECT sampled_at / {resolution} * {resolution}, SUM(delta_bytes)
+            FROM usage_samples
+            WHERE config_id IN ({placeholders}) AND sampled_at >= ? AND sampled_at < ?
+            GROUP BY 1
+            UNION ALL
+            SELECT bucket / {resolution} * {resolution}, SUM(bytes)
+            FROM usage_rollups
+            WHERE config_id IN ({placeholders}) AND resolution IN ({USAGE_HOUR}, {USAGE_DAY})
+              AND bucket >= ? AND bucket < ?
+            GROUP BY 1
+        """
+        async with db.execute(query, batch + (start, end) + batch + (start, end)) as cursor:
+            for bucket, used in await cursor.fetchall():
+                totals[bucket] = totals.get(bucket, 0) + used
     
-    return near_limit
+    return sorted(totals.items())
@@ -1,6 +1,9 @@
 # هندلرهای ادمین
 
+import time
+from datetime import datetime
 from telegram import Update
+from telegram.helpers import escape_markdown
 from telegram.ext import (
     ContextTypes,
     ConversationHandler,
@@ -15,13 +18,18 @@ from database import (
     get_user, add_user, get_all_users, update_user,
     block_user, set_traffic_limit, is_user_admin, is_user_sudo,
     get_user_configs, get_overall_stats, get_user_total_traffic,
-    get_user_remaining_traffic, get_all_active_configs, update_config_traffic
+    get_user_remaining_traffic, get_all_active_configs, get_users_usage,
+    get_job_runs, get_panel_nodes, add_panel_node, set_panel_node_active,
+    get_usage_history, USAGE_DAY
 )
-from api import Panel3XUI
+from scheduler import sync_traffic, enforce_quotas
+from api import init_panel, get_panel
+from models import bytes_to_gb
 from keyboards import (
     get_admin_panel_keyboard, get_admin_users_list_keyboard,
     get_admin_user_detail_keyboard, get_traffic_limit_keyboard,
-    get_back_keyboard, get_cancel_keyboard, get_configs_list_keyboard
+    get_back_keyboard, get_cancel_keyboard, get_configs_list_keyboard,
+    get_admin_panels_keyboard
 )
 
 
@@ -30,7 +38,8 @@ from keyboards import (
     WAITING_USER_ID,
     WAITING_TRAFFIC_LIMIT,
     WAITING_MANUAL_LIMIT,
-) = range(10, 13)
+    WAITING_PANEL_INFO,
+) = range(10, 14)
 
 
 async def check_admin_access(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -126,8 +135,8 @@ async def show_user_detail(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # دریافت آمار
-    total_used = await get_user_total_traffic(telegram_id)
-    remaining = await get_user_remaining_traffic(telegram_id)
+    total_used = bytes_to_gb(await get_user_total_traffic(telegram_id))
+    remaining = bytes_to_gb(await get_user_remaining_traffic(telegram_id))
     configs = await get_user_configs(telegram_id)
     
     role = "👑 سودو" if user.get("is_sudo") else "👨‍💼 ادمین" if user.get("is_admin") else "👤 کاربر"
@@ -228,12 +237,14 @@ async def set_traffic_limit_handler(update: Update, context: ContextTypes.DEFAUL
     limit_gb = float(parts[3])
     
     await set_traffic_limit(telegram_id, limit_gb)
+    # فعال/غیرفعال کردن کانفیگ‌ها طبق حد جدید
+    context.application.create_task(enforce_quotas(telegram_id))
     await query.answer(f"✅ حد ترافیک به {limit_gb} GB تغییر یافت", show_alert=True)
     
     # بازگشت به صفحه کاربر
     user = await get_user(telegram_id)
-    total_used = await get_user_total_traffic(telegram_id)
-    remaining = await get_user_remaining_traffic(telegram_id)
+    total_used = bytes_to_gb(await get_user_total_traffic(telegram_id))
+    remaining = bytes_to_gb(await get_user_remaining_traffic(telegram_id))
     configs = await get_user_configs(telegram_id)
     
     role = "👑 سودو" if user.get("is_sudo") else "👨‍💼 ادمین" if user.get("is_admin") else "👤 کاربر"
@@ -290,6 +301,8 @@ async def receive_manual_limit(update: Update, context: ContextTypes.DEFAULT_TYP
     telegram_id = context.user_data.get("editing_user_id")
     
     await set_traffic_limit(telegram_id, limit_gb)
+    # فعال/غیرفعال کردن کانفیگ‌ها طبق حد جدید
+    context.application.create_task(enforce_quotas(telegram_id))
     
     await update.message.reply_text(
         f"✅ حد ترافیک کاربر {telegram_id} به {limit_gb} GB تغییر یافت.",
@@ -403,7 +416,7 @@ async def show_overall_stats(update: Update, context: ContextTypes.DEFAULT_TYPE)
         f"👨‍💼 ادمین‌ها: {admin_users}\n"
         f"🚫 مسدود شده: {blocked_users}\n\n"
         f"📋 کانفیگ‌های فعال: {stats['active_configs']}\n"
-        f"📈 کل ترافیک مصرفی: {stats['total_traffic_gb']} GB"
+        f"📈 کل ترافیک مصرفی: {bytes_to_gb(stats['total_traffic_bytes']):.2f} GB"
     )
     
     await query.edit_message_text(
@@ -434,13 +447,23 @@ async def show_user_usage(update: Update, context: ContextTypes.DEFAULT_TYPE):
     total_used = 0
     for config in configs:
         status = "🗑" if config.get("is_deleted") else "✅"
-        used = config.get("deleted_traffic_gb", 0) if config.get("is_deleted") else config.get("traffic_used_gb", 0)
+        used = config.get("deleted_traffic_bytes", 0) if config.get("is_deleted") else config.get("traffic_used_bytes", 0)
         total_used += used
         
         email = config.get("panel_client_email", "")[:15]
-        message += f"{status} {email}... : {used:.2f} GB\n"
+        message += f"{status} {email}... : {bytes_to_gb(used):.2f} GB\n"
     
-    message += f"\n📈 مجموع: {total_used:.2f} GB"
+    message += f"\n📈 مجموع: {bytes_to_gb(total_used):.2f} GB"
+    
+    # مصرف روزانه هفت روز اخیر از سابقه ذخیره شده (بدون درخواست به پنل)
+    today = int(time.time()) // USAGE_DAY * USAGE_DAY
+    history = await get_usage_history(
+        [config["id"] for config in configs], today - 6 * USAGE_DAY, today + USAGE_DAY, USAGE_DAY
+    )
+    if history:
+        message += "\n\n📅 مصرف روزانه (UTC):\n"
+        for day, used in history:
+            message += f"{time.strftime('%Y-%m-%d', time.gmtime(day))}: {format_traffic(bytes_to_gb(used))}\n"
     
     await query.edit_message_text(
         message,
@@ -550,55 +573,38 @@ async def sync_traffic_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     
     try:
-        async with Panel3XUI() as panel:
-            # دریافت ترافیک همه کلاینت‌ها
-            all_traffic = await panel.get_all_clients_traffic()
-            
-            # ساخت دیکشنری برای دسترسی سریع
-            traffic_by_email = {t["email"]: t for t in all_traffic}
-            
-            # بروزرسانی ترافیک در دیتابیس
-            configs = await get_all_active_configs()
-            updated_count = 0
-            
-            for config in configs:
-                email = config.get("panel_client_email")
-                if email in traffic_by_email:
-                    traffic_gb = traffic_by_email[email].get("total_gb", 0)
-                    await update_config_traffic(config["id"], traffic_gb)
-                    updated_count += 1
+        # همگام‌سازی افزایشی ترافیک
+        result = await sync_traffic()
         
         # دریافت آمار بعد از بروزرسانی
         stats = await get_overall_stats()
-        users = await get_all_users()
         
-        # محاسبه مصرف کل کاربران
-        users_usage = []
-        for user in users:
-            if not user.get("is_blocked"):
-                total_used = await get_user_total_traffic(user["telegram_id"])
-                if total_used > 0:
-                    users_usage.append({
-                        "id": user["telegram_id"],
-                        "used": total_used,
-                        "limit": user.get("traffic_limit_gb", 0)
-                    })
+        # محاسبه مصرف کل کاربران (یک کوئری تجمیعی)
+        users_usage = [u for u in await get_users_usage() if u["used_bytes"] > 0]
         
         # مرتب‌سازی بر اساس مصرف
-        users_usage.sort(key=lambda x: x["used"], reverse=True)
+        users_usage.sort(key=lambda x: x["used_bytes"], reverse=True)
+        
+        if result.get("error"):
+            # پنل‌هایی که پاسخ ندادند همگام نشده‌اند
+            header = (f"⚠️ همگام‌سازی با خطا در برخی پنل‌ها انجام شد:\n"
+                      f"{escape_markdown(result['error'])}\n\n")
+        else:
+            header = "✅ همگام‌سازی با موفقیت انجام شد!\n\n"
         
         message = (
-            f"✅ همگام‌سازی با موفقیت انجام شد!\n\n"
+            header +
             f"📊 آمار:\n"
-            f"• کانفیگ‌های بروزرسانی شده: {updated_count}\n"
-            f"• کل ترافیک مصرفی: {format_traffic(stats['total_traffic_gb'])}\n\n"
+            f"• کانفیگ‌های بررسی شده: {result['matched']}\n"
+            f"• کانفیگ‌های تغییر کرده: {result['changed']}\n"
+            f"• کل ترافیک مصرفی: {format_traffic(bytes_to_gb(stats['total_traffic_bytes']))}\n\n"
         )
         
         if users_usage:
             message += "👥 مصرف کاربران:\n"
             for i, u in enumerate(users_usage[:10], 1):
-                percent = (u["used"] / u["limit"] * 100) if u["limit"] > 0 else 0
-                message += f"{i}. `{u['id']}`: {format_traffic(u['used'])}/{u['limit']} GB ({percent:.0f}%)\n"
+                message += (f"{i}. `{u['telegram_id']}`: {format_traffic(bytes_to_gb(u['used_bytes']))}"
+                            f"/{u['limit_gb']} GB ({u['percent']:.0f}%)\n")
         
         await query.edit_message_text(
             message,
@@ -613,6 +619,141 @@ async def sync_traffic_handler(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
+async def show_job_runs(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش آخرین اجراهای همگام‌سازی ترافیک"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not await check_admin_access(update, context):
+        return
+    
+    runs = await get_job_runs("traffic_sync")
+    
+    if not runs:
+        message = "📜 هنوز همگام‌سازی انجام نشده است."
+    else:
+        message = "📜 آخرین همگام‌سازی‌های ترافیک:\n\n"
+        for run in runs:
+            started = datetime.fromtimestamp(run["started_at"]).strftime("%m/%d %H:%M")
+            fetch = f"{run['fetch_seconds']:.1f}s" if run["fetch_seconds"] is not None else "-"
+            if run["error"]:
+                status = f"❌ {run['error'][:60]}"
+            else:
+                status = f"✅ {run['matched']} بررسی، {run['changed']} تغییر"
+            message += (f"🕐 {started} | {run['duration_seconds']:.1f}s "
+                        f"(پنل: {fetch})\n{status}\n\n")
+    
+    await query.edit_message_text(
+        message,
+        reply_markup=get_back_keyboard()
+    )
+
+
+# ==================== مدیریت پنل‌ها ====================
+
+async def show_panels(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """نمایش لیست پنل‌ها (نودها)"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not await check_admin_access(update, context):
+        return
+    
+    panels = await get_panel_nodes(active_only=False)
+    
+    message = "🖥 پنل‌های ثبت شده:\n\n"
+    for panel in panels:
+        status = "✅ فعال" if panel["is_active"] else "⏸ بدون کانفیگ جدید"
+        message += f"• {panel['name']} ({panel['url']}) - {status}\n"
+    message += "\nبرای فعال/غیرفعال کردن ساخت کانفیگ روی هر پنل، روی آن بزنید."
+    
+    await query.edit_message_text(
+        message,
+        reply_markup=get_admin_panels_keyboard(panels)
+    )
+
+
+async def toggle_panel_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """فعال/غیرفعال کردن ساخت کانفیگ روی یک پنل"""
+    query = update.callback_query
+    
+    if not await check_admin_access(update, context):
+        return
+    
+    panel_id = int(query.data.split("_")[-1])
+    panel = next((p for p in await get_panel_nodes(active_only=False) if p["id"] == panel_id), None)
+    if panel is None:
+        await query.answer("پنل یافت نشد", show_alert=True)
+        return
+    
+    await set_panel_node_active(panel_id, not panel["is_active"])
+    await init_panel()
+    
+    await show_panels(update, context)
+
+
+async def add_panel_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """شروع افزودن پنل جدید"""
+    query = update.callback_query
+    await query.answer()
+    
+    if not await check_admin_access(update, context):
+        return ConversationHandler.END
+    
+    await query.edit_message_text(
+        "🖥 اطلاعات پنل جدید را در یک خط وارد کنید:\n"
+        "نام آدرس نام‌کاربری رمز\n\n"
+        "مثال:\n"
+        "de1 https://de1.example.com:2053 admin password",
+        reply_markup=get_cancel_keyboard()
+    )
+    
+    return WAITING_PANEL_INFO
+
+
+async def receive_panel_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """دریافت اطلاعات پنل جدید"""
+    parts = update.message.text.strip().split()
+    if len(parts) != 4 or not parts[1].startswith(("http://", "https://")):
+        await update.message.reply_text(
+            "❌ فرمت نامعتبر. نام، آدرس (با http/https)، نام‌کاربری و رمز را با فاصله وارد کنید.",
+            reply_markup=get_cancel_keyboard()
+        )
+        return WAITING_PANEL_INFO
+    
+    name, url, username, password = parts
+    # پیام حاوی رمز پنل در چت باقی نماند
+    try:
+        await update.message.delete()
+    except Exception as e:
+        print(f"Delete panel message error: {e}")
+    
+    panel_id = await add_panel_node(name, url, username, password)
+    if panel_id is None:
+        await update.message.reply_text(
+            "❌ خطا در ثبت پنل (ممکن است این آدرس قبلاً ثبت شده باشد).",
+            reply_markup=get_back_keyboard()
+        )
+        return ConversationHandler.END
+    
+    # اتصال و ورود به پنل جدید
+    await init_panel()
+    panel = await get_panel(panel_id)
+    
+    if panel.cookies:
+        message = f"✅ پنل {name} ثبت و متصل شد."
+    else:
+        message = f"⚠️ پنل {name} ثبت شد ولی ورود به آن ناموفق بود. اطلاعات ورود را بررسی کنید."
+    
+    await update.message.reply_text(
+        message,
+        reply_markup=get_back_keyboard()
+    )
+    
+    context.user_data.clear()
+    return ConversationHandler.END
+
+
 # ==================== لغو عملیات ادمین ====================
 
 async def cancel_admin_operation(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -667,9 +808,24 @@ def get_admin_handlers():
         per_message=False,
     )
     
+    # مکالمه افزودن پنل
+    add_panel_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(add_panel_start, pattern="^admin_add_panel$")],
+        states={
+            WAITING_PANEL_INFO: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, receive_panel_info),
+            ],
+        },
+        fallbacks=[
+            CallbackQueryHandler(cancel_admin_operation, pattern="^cancel$"),
+        ],
+        per_message=False,
+    )
+    
     handlers = [
         add_user_conv,
         manual_limit_conv,
+        add_panel_conv,
         CallbackQueryHandler(show_admin_panel, pattern="^admin_panel$"),
         CallbackQueryHandler(show_users_list, pattern="^admin_users$"),
         CallbackQueryHandler(users_page_navigation, pattern="^users_page_"),
@@ -684,6 +840,9 @@ def get_admin_handlers():
         CallbackQueryHandler(show_all_configs, pattern="^admin_all_configs$"),
         CallbackQueryHandler(search_start, pattern="^admin_search$"),
         CallbackQueryHandler(sync_traffic_handler, pattern="^admin_sync_traffic$"),
+        CallbackQueryHandler(show_job_runs, pattern="^admin_job_runs$"),
+        CallbackQueryHandler(show_panels, pattern="^admin_panels$"),
+        CallbackQueryHandler(toggle_panel_handler, pattern="^panel_toggle_\\d+$"),
     ]
     
     return handlers
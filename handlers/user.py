@@ -1,5 +1,6 @@
 # هندلرهای کاربران عادی
 
+import asyncio
 import time
 import uuid
 from telegram import Update
@@ -12,14 +13,19 @@ from telegram.ext import (
     filters,
 )
 
-from config import MESSAGES, SUDO_ADMIN_ID, DEFAULT_TRAFFIC_LIMIT_GB
+from config import (
+    MESSAGES, SUDO_ADMIN_ID, DEFAULT_TRAFFIC_LIMIT_GB, BULK_CREATE_MAX_COUNT,
+    USER_TRAFFIC_REFRESH_COOLDOWN_SECONDS
+)
 from database import (
     get_user, add_user, get_user_configs, get_config,
-    add_config, delete_config, extend_config,
+    add_config, add_configs, delete_config, extend_config,
     get_user_total_traffic, get_user_remaining_traffic,
-    is_user_blocked, update_config_traffic
+    is_user_blocked, update_config_traffic, update_configs_traffic
 )
-from api import Panel3XUI
+from api import get_panel, get_all_inbounds, pick_inbound
+from scheduler import enforce_quotas
+from models import bytes_to_gb
 from keyboards import (
     get_main_menu_keyboard, get_back_keyboard, get_cancel_keyboard,
     get_inbound_selection_keyboard, get_traffic_amount_keyboard,
@@ -41,7 +47,13 @@ from keyboards import (
     # حالت‌های تمدید
     EXTEND_ENTERING_TRAFFIC,
     EXTEND_ENTERING_TIME,
-) = range(9)
+    # ساخت گروهی
+    ENTERING_BULK_COUNT,
+) = range(10)
+
+# زمان آخرین بروزرسانی دستی ترافیک هر کاربر (telegram_id -> monotonic)
+# خارج از user_data تا با پاک شدن آن در مکالمه‌ها cooldown ریست نشود
+_traffic_refreshed_at: dict[int, float] = {}
 
 
 async def check_user_access(update: Update, context: ContextTypes.DEFAULT_TYPE) -> bool:
@@ -141,12 +153,24 @@ async def cancel_operation(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def create_config_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """شروع ساخت کانفیگ"""
+    return await _start_create(update, context, bulk=False)
+
+
+async def bulk_create_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """شروع ساخت گروهی کانفیگ"""
+    return await _start_create(update, context, bulk=True)
+
+
+async def _start_create(update: Update, context: ContextTypes.DEFAULT_TYPE, bulk: bool):
+    """بررسی دسترسی و نمایش لیست سرورها برای ساخت تکی یا گروهی"""
     query = update.callback_query
     await query.answer()
     
     if not await check_user_access(update, context):
         return ConversationHandler.END
     
+    context.user_data["bulk"] = bulk
+    
     telegram_id = update.effective_user.id
     user = await get_user(telegram_id)
     
@@ -159,11 +183,10 @@ async def create_config_start(update: Update, context: ContextTypes.DEFAULT_TYPE
         )
         return ConversationHandler.END
     
-    # دریافت لیست inbound ها
-    async with Panel3XUI() as panel:
-        inbounds = await panel.get_inbounds()
+    # دریافت لیست inbound ها از همه پنل‌ها
+    panel_inbounds = await get_all_inbounds(allow_stale=True)
     
-    if not inbounds:
+    if not panel_inbounds:
         await query.edit_message_text(
             "❌ خطا در دریافت لیست سرورها. لطفاً دوباره تلاش کنید.",
             reply_markup=get_back_keyboard()
@@ -172,7 +195,7 @@ async def create_config_start(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     await query.edit_message_text(
         "🔹 لطفاً سرور مورد نظر را انتخاب کنید:",
-        reply_markup=get_inbound_selection_keyboard(inbounds)
+        reply_markup=get_inbound_selection_keyboard(panel_inbounds)
     )
     
     return SELECTING_INBOUND
@@ -183,12 +206,36 @@ async def select_inbound(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    # استخراج inbound_id از callback_data
-    inbound_id = int(query.data.split("_")[-1])
+    selected = ""
+    if query.data == "select_inbound_auto":
+        # انتخاب کم‌بارترین inbound از کش لیست پنل‌ها
+        picked = await pick_inbound()
+        if picked is None:
+            await query.edit_message_text(
+                "❌ سرور فعالی برای انتخاب خودکار یافت نشد.",
+                reply_markup=get_back_keyboard()
+            )
+            context.user_data.clear()
+            return ConversationHandler.END
+        panel, inbound = picked
+        panel_id, inbound_id = panel.panel_id, inbound.get("id")
+        selected = f"✅ سرور انتخاب شده: {inbound.get('remark', inbound_id)}\n\n"
+    else:
+        # استخراج پنل و inbound_id از callback_data
+        panel_id, inbound_id = map(int, query.data.split("_")[-2:])
+    context.user_data["panel_id"] = panel_id
     context.user_data["inbound_id"] = inbound_id
     
+    if context.user_data.get("bulk"):
+        await query.edit_message_text(
+            f"{selected}📝 لطفاً پیشوند نام کانفیگ‌ها را وارد کنید:\n"
+            "(فقط حروف انگلیسی و اعداد)",
+            reply_markup=get_cancel_keyboard()
+        )
+        return ENTERING_USERNAME
+    
     await query.edit_message_text(
-        "📝 لطفاً نام کاربری برای کانفیگ وارد کنید:\n"
+        f"{selected}📝 لطفاً نام کاربری برای کانفیگ وارد کنید:\n"
         "(فقط حروف انگلیسی و اعداد)",
         reply_markup=get_cancel_keyboard()
     )
@@ -209,6 +256,16 @@ async def enter_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ENTERING_USERNAME
     
+    if context.user_data.get("bulk"):
+        context.user_data["prefix"] = username
+        context.user_data["display_name"] = username
+        await update.message.reply_text(
+            f"🔢 تعداد کانفیگ‌ها را وارد کنید:\n"
+            f"(حداکثر {BULK_CREATE_MAX_COUNT})",
+            reply_markup=get_cancel_keyboard()
+        )
+        return ENTERING_BULK_COUNT
+    
     # ایجاد ایمیل یکتا
     telegram_id = update.effective_user.id
     email = f"{username}_{telegram_id}_{int(time.time())}"
@@ -223,6 +280,29 @@ async def enter_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return SELECTING_TRAFFIC
 
 
+async def enter_bulk_count(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """وارد کردن تعداد کانفیگ‌ها برای ساخت گروهی"""
+    try:
+        count = int(update.message.text.strip())
+        if count < 1 or count > BULK_CREATE_MAX_COUNT:
+            raise ValueError("Out of range")
+    except ValueError:
+        await update.message.reply_text(
+            f"❌ مقدار نامعتبر. لطفاً عددی بین 1 و {BULK_CREATE_MAX_COUNT} وارد کنید.",
+            reply_markup=get_cancel_keyboard()
+        )
+        return ENTERING_BULK_COUNT
+    
+    context.user_data["count"] = count
+    
+    await update.message.reply_text(
+        "📊 حجم ترافیک هر کانفیگ را انتخاب کنید:",
+        reply_markup=get_traffic_amount_keyboard()
+    )
+    
+    return SELECTING_TRAFFIC
+
+
 async def select_traffic(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """انتخاب حجم ترافیک"""
     query = update.callback_query
@@ -325,13 +405,23 @@ async def _process_expiry(update: Update, context: ContextTypes.DEFAULT_TYPE, da
     traffic_text = f"{traffic} GB" if traffic > 0 else "نامحدود"
     expiry_text = f"{days} روز" if days > 0 else "نامحدود"
     
-    summary = (
-        f"📋 خلاصه کانفیگ:\n\n"
-        f"👤 نام: {context.user_data.get('display_name')}\n"
-        f"📊 حجم: {traffic_text}\n"
-        f"⏰ اعتبار: {expiry_text}\n\n"
-        f"آیا تأیید می‌کنید؟"
-    )
+    if context.user_data.get("bulk"):
+        summary = (
+            f"📋 خلاصه ساخت گروهی:\n\n"
+            f"🏷 پیشوند: {context.user_data.get('prefix')}\n"
+            f"🔢 تعداد: {context.user_data.get('count')}\n"
+            f"📊 حجم هر کانفیگ: {traffic_text}\n"
+            f"⏰ اعتبار: {expiry_text}\n\n"
+            f"آیا تأیید می‌کنید؟"
+        )
+    else:
+        summary = (
+            f"📋 خلاصه کانفیگ:\n\n"
+            f"👤 نام: {context.user_data.get('display_name')}\n"
+            f"📊 حجم: {traffic_text}\n"
+            f"⏰ اعتبار: {expiry_text}\n\n"
+            f"آیا تأیید می‌کنید؟"
+        )
     
     from keyboards import get_yes_no_keyboard
     
@@ -355,9 +445,13 @@ async def confirm_create_config(update: Update, context: ContextTypes.DEFAULT_TY
     query = update.callback_query
     await query.answer()
     
+    if context.user_data.get("bulk"):
+        return await _confirm_bulk_create(update, context)
+    
     telegram_id = update.effective_user.id
     
     # دریافت داده‌ها
+    panel_id = context.user_data.get("panel_id", 1)
     inbound_id = context.user_data.get("inbound_id")
     email = context.user_data.get("email")
     traffic_gb = context.user_data.get("traffic_gb", 0)
@@ -367,33 +461,35 @@ async def confirm_create_config(update: Update, context: ContextTypes.DEFAULT_TY
     
     try:
         # ساخت کانفیگ در پنل
-        async with Panel3XUI() as panel:
-            result = await panel.add_client(
-                inbound_id=inbound_id,
-                email=email,
-                total_gb=traffic_gb,
-                expiry_time=expiry_time
-            )
-            
-            if not result.get("success"):
-                await query.edit_message_text(
-                    f"❌ خطا در ساخت کانفیگ:\n{result.get('msg', 'Unknown error')}",
-                    reply_markup=get_back_keyboard()
-                )
-                return ConversationHandler.END
-            
-            # ذخیره در دیتابیس
-            config_id = await add_config(
-                owner_telegram_id=telegram_id,
-                panel_client_email=email,
-                inbound_id=inbound_id,
-                traffic_limit_gb=traffic_gb,
-                expiry_time=expiry_time
+        panel = await get_panel(panel_id)
+        result = await panel.add_client(
+            inbound_id=inbound_id,
+            email=email,
+            total_gb=traffic_gb,
+            expiry_time=expiry_time
+        )
+        
+        if not result.get("success"):
+            await query.edit_message_text(
+                f"❌ خطا در ساخت کانفیگ:\n{result.get('msg', 'Unknown error')}",
+                reply_markup=get_back_keyboard()
             )
-            
-            # دریافت لینک‌ها
-            sub_link = await panel.get_subscription_link(inbound_id, email)
-            config_link = await panel.get_config_link(inbound_id, email)
+            return ConversationHandler.END
+        
+        # ذخیره در دیتابیس
+        config_id = await add_config(
+            owner_telegram_id=telegram_id,
+            panel_client_email=email,
+            inbound_id=inbound_id,
+            traffic_limit_gb=traffic_gb,
+            expiry_time=expiry_time,
+            panel_id=panel_id
+        )
+        
+        # دریافت لینک‌ها
+        links = await panel.get_client_links(inbound_id, email)
+        sub_link = links.get("sub_link", "")
+        config_link = links.get("config_link", "")
         
         # نمایش نتیجه
         traffic_text = f"{traffic_gb} GB" if traffic_gb > 0 else "نامحدود"
@@ -430,6 +526,100 @@ async def confirm_create_config(update: Update, context: ContextTypes.DEFAULT_TY
     return ConversationHandler.END
 
 
+async def _confirm_bulk_create(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """ساخت گروهی کانفیگ‌ها و ارسال همه لینک‌ها در یک فایل"""
+    query = update.callback_query
+    telegram_id = update.effective_user.id
+    
+    panel_id = context.user_data.get("panel_id", 1)
+    inbound_id = context.user_data.get("inbound_id")
+    prefix = context.user_data.get("prefix")
+    count = context.user_data.get("count", 0)
+    traffic_gb = context.user_data.get("traffic_gb", 0)
+    expiry_time = context.user_data.get("expiry_time", 0)
+    
+    await query.edit_message_text(f"⏳ در حال ساخت {count} کانفیگ...")
+    
+    try:
+        # ایجاد ایمیل‌های یکتا
+        created_at = int(time.time())
+        emails = [f"{prefix}{i:03d}_{telegram_id}_{created_at}" for i in range(1, count + 1)]
+        
+        # ساخت کانفیگ‌ها در پنل
+        panel = await get_panel(panel_id)
+        result = await panel.add_clients(inbound_id, [
+            {"email": email, "total_gb": traffic_gb, "expiry_time": expiry_time}
+            for email in emails
+        ])
+        created_emails = [c["email"] for c in result["created"]]
+        
+        if not created_emails:
+            msg = result["failed"][0]["msg"] if result["failed"] else "Unknown error"
+            await query.edit_message_text(
+                f"❌ خطا در ساخت کانفیگ‌ها:\n{msg}",
+                reply_markup=get_back_keyboard()
+            )
+            context.user_data.clear()
+            return ConversationHandler.END
+        
+        # ذخیره در دیتابیس
+        saved = await add_configs(
+            owner_telegram_id=telegram_id,
+            panel_client_emails=created_emails,
+            inbound_id=inbound_id,
+            traffic_limit_gb=traffic_gb,
+            expiry_time=expiry_time,
+            panel_id=panel_id
+        )
+        
+        if saved < len(created_emails):
+            # کلاینت بدون ردیف configs در همگام‌سازی و سهمیه دیده نمی‌شود - از پنل حذف می‌شود
+            for client in result["created"]:
+                await panel.delete_client(inbound_id, client["uuid"])
+            await query.edit_message_text(
+                "❌ خطا در ذخیره کانفیگ‌ها در دیتابیس. کانفیگ‌های ساخته شده از پنل حذف شدند.",
+                reply_markup=get_back_keyboard()
+            )
+            context.user_data.clear()
+            return ConversationHandler.END
+        
+        # دریافت لینک‌ها (inbound فقط یک بار از پنل گرفته می‌شود)
+        lines = []
+        for email in created_emails:
+            links = await panel.get_client_links(inbound_id, email)
+            lines.append(email)
+            if links.get("config_link"):
+                lines.append(links["config_link"])
+            if links.get("sub_link"):
+                lines.append(links["sub_link"])
+            lines.append("")
+        
+        await context.bot.send_document(
+            chat_id=telegram_id,
+            document="\n".join(lines).encode("utf-8"),
+            filename=f"{prefix}_configs.txt",
+            caption=f"📦 {len(created_emails)} کانفیگ با پیشوند {prefix}"
+        )
+        
+        message = f"✅ {len(created_emails)} کانفیگ با موفقیت ساخته شد!"
+        if result["failed"]:
+            message += f"\n⚠️ {len(result['failed'])} کانفیگ ساخته نشد."
+        
+        await query.edit_message_text(
+            message,
+            reply_markup=get_back_keyboard()
+        )
+        
+    except Exception as e:
+        await query.edit_message_text(
+            f"❌ خطا: {str(e)}",
+            reply_markup=get_back_keyboard()
+        )
+    
+    context.user_data.clear()
+    return ConversationHandler.END
+
+
 # ==================== مشاهده کانفیگ‌ها ====================
 
 async def show_my_configs(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -473,15 +663,16 @@ async def view_config_detail(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     # دریافت ترافیک از پنل
-    async with Panel3XUI() as panel:
-        traffic_data = await panel.get_client_traffic(config["panel_client_email"])
+    panel = await get_panel(config["panel_id"])
+    traffic_data = await panel.get_client_traffic(config["panel_client_email"])
     
     # بروزرسانی ترافیک در دیتابیس
     if traffic_data.get("success"):
-        await update_config_traffic(config_id, traffic_data.get("total_gb", 0))
-        used_gb = traffic_data.get("total_gb", 0)
+        used_bytes = traffic_data["total_bytes"]
+        await update_config_traffic(config_id, used_bytes)
     else:
-        used_gb = config.get("traffic_used_gb", 0)
+        used_bytes = config.get("traffic_used_bytes", 0)
+    used_gb = bytes_to_gb(used_bytes)
     
     # محاسبه اطلاعات
     limit_gb = config.get("traffic_limit_gb", 0)
@@ -530,15 +721,15 @@ async def show_config_traffic(update: Update, context: ContextTypes.DEFAULT_TYPE
         await query.answer("کانفیگ یافت نشد", show_alert=True)
         return
     
-    async with Panel3XUI() as panel:
-        traffic_data = await panel.get_client_traffic(config["panel_client_email"])
+    panel = await get_panel(config["panel_id"])
+    traffic_data = await panel.get_client_traffic(config["panel_client_email"])
     
     if traffic_data.get("success"):
         message = (
             f"📊 آمار ترافیک:\n\n"
-            f"⬆️ آپلود: {traffic_data.get('upload_gb', 0):.3f} GB\n"
-            f"⬇️ دانلود: {traffic_data.get('download_gb', 0):.3f} GB\n"
-            f"📈 کل: {traffic_data.get('total_gb', 0):.3f} GB"
+            f"⬆️ آپلود: {bytes_to_gb(traffic_data['upload_bytes']):.3f} GB\n"
+            f"⬇️ دانلود: {bytes_to_gb(traffic_data['download_bytes']):.3f} GB\n"
+            f"📈 کل: {bytes_to_gb(traffic_data['total_bytes']):.3f} GB"
         )
     else:
         message = "❌ خطا در دریافت آمار ترافیک"
@@ -558,15 +749,13 @@ async def copy_config_link(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("کانفیگ یافت نشد", show_alert=True)
         return
     
-    async with Panel3XUI() as panel:
-        config_link = await panel.get_config_link(
-            config["inbound_id"], 
-            config["panel_client_email"]
-        )
-        sub_link = await panel.get_subscription_link(
-            config["inbound_id"],
-            config["panel_client_email"]
-        )
+    panel = await get_panel(config["panel_id"])
+    links = await panel.get_client_links(
+        config["inbound_id"],
+        config["panel_client_email"]
+    )
+    config_link = links.get("config_link", "")
+    sub_link = links.get("sub_link", "")
     
     message = f"📱 لینک کانفیگ:\n`{config_link}`"
     
@@ -612,17 +801,17 @@ async def delete_config_final(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     
     # دریافت ترافیک فعلی
-    async with Panel3XUI() as panel:
-        traffic_data = await panel.get_client_traffic(config["panel_client_email"])
-        final_traffic = traffic_data.get("total_gb", 0) if traffic_data.get("success") else 0
-        
-        # پیدا کردن uuid کلاینت
-        client_info = await panel.get_client_by_email(config["panel_client_email"])
-        
-        if client_info.get("success"):
-            uuid_str = client_info["client"].get("id")
-            # حذف از پنل
-            await panel.delete_client(config["inbound_id"], uuid_str)
+    panel = await get_panel(config["panel_id"])
+    traffic_data = await panel.get_client_traffic(config["panel_client_email"])
+    final_traffic = traffic_data["total_bytes"] if traffic_data.get("success") else 0
+    
+    # پیدا کردن uuid کلاینت
+    client_info = await panel.get_client_by_email(config["panel_client_email"])
+    
+    if client_info.get("success"):
+        uuid_str = client_info["client"].get("id")
+        # حذف از پنل
+        await panel.delete_client(config["inbound_id"], uuid_str)
     
     # حذف نرم از دیتابیس (حفظ ترافیک مصرفی)
     await delete_config(config_id, final_traffic)
@@ -874,21 +1063,23 @@ async def extend_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         # بروزرسانی در پنل
-        async with Panel3XUI() as panel:
-            client_info = await panel.get_client_by_email(config["panel_client_email"])
-            
-            if client_info.get("success"):
-                uuid_str = client_info["client"].get("id")
-                await panel.update_client(
-                    inbound_id=config["inbound_id"],
-                    uuid_str=uuid_str,
-                    email=config["panel_client_email"],
-                    total_gb=new_limit,
-                    expiry_time=new_expiry
-                )
+        panel = await get_panel(config["panel_id"])
+        client_info = await panel.get_client_by_email(config["panel_client_email"])
+        
+        if client_info.get("success"):
+            uuid_str = client_info["client"].get("id")
+            await panel.update_client(
+                inbound_id=config["inbound_id"],
+                uuid_str=uuid_str,
+                email=config["panel_client_email"],
+                total_gb=new_limit,
+                expiry_time=new_expiry
+            )
         
         # بروزرسانی در دیتابیس
         await extend_config(config_id, new_expiry, traffic_gb)
+        # فعال کردن دوباره کانفیگ منقضی شده
+        context.application.create_task(enforce_quotas(config["owner_telegram_id"]))
         
         traffic_text = f"+{traffic_gb} GB" if traffic_gb > 0 else ""
         time_text = f"+{days} روز" if days > 0 else ""
@@ -932,8 +1123,8 @@ async def show_traffic_status(update: Update, context: ContextTypes.DEFAULT_TYPE
     telegram_id = update.effective_user.id
     user = await get_user(telegram_id)
     
-    total_used = await get_user_total_traffic(telegram_id)
-    remaining = await get_user_remaining_traffic(telegram_id)
+    total_used = bytes_to_gb(await get_user_total_traffic(telegram_id))
+    remaining = bytes_to_gb(await get_user_remaining_traffic(telegram_id))
     limit = user.get("traffic_limit_gb", 0)
     
     percent = (total_used / limit * 100) if limit > 0 else 0
@@ -977,16 +1168,42 @@ async def refresh_my_traffic(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     try:
-        async with Panel3XUI() as panel:
+        # در فاصله cooldown فقط داده ذخیره شده نمایش داده می‌شود
+        now = time.monotonic()
+        last_refresh = _traffic_refreshed_at.get(telegram_id, 0)
+        if now - last_refresh >= USER_TRAFFIC_REFRESH_COOLDOWN_SECONDS:
+            # فقط کلاینت‌های همین کاربر از هر پنل (از کش لیست یا getClientTraffics)
+            emails_by_panel = {}
             for config in configs:
-                traffic_data = await panel.get_client_traffic(config["panel_client_email"])
-                if traffic_data.get("success"):
-                    await update_config_traffic(config["id"], traffic_data.get("total_gb", 0))
+                emails_by_panel.setdefault(config["panel_id"], []).append(
+                    config["panel_client_email"]
+                )
+            panels = [await get_panel(panel_id) for panel_id in sorted(emails_by_panel)]
+            results = await asyncio.gather(
+                *(panel.get_clients_traffic(emails_by_panel[panel.panel_id]) for panel in panels),
+                return_exceptions=True
+            )
+            # پنلی که پاسخ نداده نادیده گرفته می‌شود تا داده قدیمی ذخیره نشود
+            all_traffic = {
+                (panel.panel_id, email): total_bytes
+                for panel, panel_traffic in zip(panels, results)
+                if not isinstance(panel_traffic, Exception)
+                for email, total_bytes in panel_traffic.items()
+            }
+            
+            updates = []
+            for config in configs:
+                traffic_bytes = all_traffic.get((config["panel_id"], config["panel_client_email"]))
+                if traffic_bytes is not None and traffic_bytes != config["traffic_used_bytes"]:
+                    updates.append((config["id"], traffic_bytes))
+            # نوشتن همه تغییرات در یک تراکنش
+            await update_configs_traffic(updates)
+            _traffic_refreshed_at[telegram_id] = now
         
         # نمایش وضعیت بروز شده
         user = await get_user(telegram_id)
-        total_used = await get_user_total_traffic(telegram_id)
-        remaining = await get_user_remaining_traffic(telegram_id)
+        total_used = bytes_to_gb(await get_user_total_traffic(telegram_id))
+        remaining = bytes_to_gb(await get_user_remaining_traffic(telegram_id))
         limit = user.get("traffic_limit_gb", 0)
         
         percent = (total_used / limit * 100) if limit > 0 else 0
@@ -1023,6 +1240,8 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "📖 راهنمای استفاده از ربات:\n\n"
         "➕ **ساخت کانفیگ:**\n"
         "برای ساخت کانفیگ جدید، سرور، نام، حجم و زمان را انتخاب کنید.\n\n"
+        "📦 **ساخت گروهی:**\n"
+        "چند کانفیگ با یک پیشوند بسازید و همه لینک‌ها را در یک فایل دریافت کنید.\n\n"
         "📋 **کانفیگ‌های من:**\n"
         "لیست کانفیگ‌های ساخته شده را مشاهده کنید.\n\n"
         "📊 **وضعیت ترافیک:**\n"
@@ -1049,7 +1268,10 @@ def get_user_handlers():
     
     # مکالمه ساخت کانفیگ
     create_config_conv = ConversationHandler(
-        entry_points=[CallbackQueryHandler(create_config_start, pattern="^create_config$")],
+        entry_points=[
+            CallbackQueryHandler(create_config_start, pattern="^create_config$"),
+            CallbackQueryHandler(bulk_create_start, pattern="^bulk_create$"),
+        ],
         states={
             SELECTING_INBOUND: [
                 CallbackQueryHandler(select_inbound, pattern="^select_inbound_"),
@@ -1057,6 +1279,9 @@ def get_user_handlers():
             ENTERING_USERNAME: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, enter_username),
             ],
+            ENTERING_BULK_COUNT: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, enter_bulk_count),
+            ],
             SELECTING_TRAFFIC: [
                 CallbackQueryHandler(select_traffic, pattern="^traffic_"),
             ],
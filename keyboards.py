@@ -17,6 +17,7 @@ def get_main_menu_keyboard(is_admin: bool = False, is_sudo: bool = False) -> Inl
             InlineKeyboardButton("🔄 بروزرسانی", callback_data="refresh_my_traffic"),
         ],
         [
+            InlineKeyboardButton("📦 ساخت گروهی", callback_data="bulk_create"),
             InlineKeyboardButton("ℹ️ راهنما", callback_data="help"),
         ],
     ]
@@ -43,21 +44,27 @@ def get_cancel_keyboard() -> InlineKeyboardMarkup:
 
 # ==================== کیبوردهای ساخت کانفیگ ====================
 
-def get_inbound_selection_keyboard(inbounds: list) -> InlineKeyboardMarkup:
-    """کیبورد انتخاب inbound"""
-    keyboard = []
+def get_inbound_selection_keyboard(panel_inbounds: list) -> InlineKeyboardMarkup:
+    """کیبورد انتخاب inbound - panel_inbounds لیست (پنل، inboundها)"""
+    keyboard = [[
+        InlineKeyboardButton("🤖 انتخاب خودکار (کم‌بارترین سرور)", callback_data="select_inbound_auto")
+    ]]
+    # نام پنل فقط وقتی بیش از یک پنل وجود دارد نمایش داده می‌شود
+    show_panel = len(panel_inbounds) > 1
     
-    for inbound in inbounds:
-        inbound_id = inbound.get("id")
-        remark = inbound.get("remark", f"Inbound {inbound_id}")
-        protocol = inbound.get("protocol", "").upper()
-        
-        keyboard.append([
-            InlineKeyboardButton(
-                f"🔹 {remark} ({protocol})",
-                callback_data=f"select_inbound_{inbound_id}"
-            )
-        ])
+    for panel, inbounds in panel_inbounds:
+        for inbound in inbounds:
+            inbound_id = inbound.get("id")
+            remark = inbound.get("remark", f"Inbound {inbound_id}")
+            protocol = inbound.get("protocol", "").upper()
+            prefix = f"{panel.name} | " if show_panel else ""
+            
+            keyboard.append([
+                InlineKeyboardButton(
+                    f"🔹 {prefix}{remark} ({protocol})",
+                    callback_data=f"select_inbound_{panel.panel_id}_{inbound_id}"
+                )
+            ])
     
     keyboard.append([InlineKeyboardButton("❌ لغو", callback_data="cancel")])
     
@@ -229,9 +236,11 @@ def get_admin_panel_keyboard() -> InlineKeyboardMarkup:
         ],
         [
             InlineKeyboardButton("📋 همه کانفیگ‌ها", callback_data="admin_all_configs"),
+            InlineKeyboardButton("🖥 پنل‌ها", callback_data="admin_panels"),
         ],
         [
             InlineKeyboardButton("🔄 همگام‌سازی ترافیک", callback_data="admin_sync_traffic"),
+            InlineKeyboardButton("📜 سابقه همگام‌سازی", callback_data="admin_job_runs"),
         ],
         [InlineKeyboardButton("🔙 بازگشت", callback_data="back_main")]
     ]
@@ -292,6 +301,24 @@ def get_admin_user_detail_keyboard(telegram_id: int, is_blocked: bool) -> Inline
     return InlineKeyboardMarkup(keyboard)
 
 
+def get_admin_panels_keyboard(panels: list) -> InlineKeyboardMarkup:
+    """کیبورد مدیریت پنل‌ها"""
+    keyboard = []
+    
+    for panel in panels:
+        status = "✅" if panel["is_active"] else "⏸"
+        keyboard.append([
+            InlineKeyboardButton(
+                f"{status} {panel['name']}",
+                callback_data=f"panel_toggle_{panel['id']}"
+            )
+        ])
+    
+    keyboard.append([InlineKeyboardButton("➕ افزودن پنل", callback_data="admin_add_panel")])
+    keyboard.append([InlineKeyboardButton("🔙 بازگشت", callback_data="admin_panel")])
+    return InlineKeyboardMarkup(keyboard)
+
+
 def get_traffic_limit_keyboard(telegram_id: int) -> InlineKeyboardMarkup:
     """کیبورد تنظیم حد ترافیک"""
     keyboard = [
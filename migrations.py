@@ -0,0 +1,481 @@
+# migrationهای نسخه‌دار دیتابیس
+
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from config import (
+    DB_BACKFILL_BATCH_SIZE, DB_ONLINE_BACKFILL,
+    PANEL_URL, PANEL_USERNAME, PANEL_PASSWORD
+)
+from database import get_db, transaction, get_setting
+from models import BYTES_PER_GB
+
+
+# کلید نسخه schema در جدول settings
+SCHEMA_VERSION_KEY = "schema_version"
+
+# تسک پس‌زمینه backfillهای آنلاین
+_backfill_task: asyncio.Task | None = None
+
+
+# ==================== migrationها ====================
+
+async def _m001_base_schema(db):
+    """جداول پایه"""
+    # جدول کاربران
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            is_admin BOOLEAN DEFAULT 0,
+            is_sudo BOOLEAN DEFAULT 0,
+            traffic_limit_gb REAL DEFAULT 50,
+            is_blocked BOOLEAN DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # جدول کانفیگ‌ها
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS configs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            owner_telegram_id INTEGER NOT NULL,
+            panel_client_email TEXT NOT NULL,
+            inbound_id INTEGER NOT NULL,
+            traffic_limit_gb REAL NOT NULL,
+            traffic_used_gb REAL DEFAULT 0,
+            expiry_time INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_deleted BOOLEAN DEFAULT 0,
+            deleted_traffic_gb REAL DEFAULT 0,
+            FOREIGN KEY (owner_telegram_id) REFERENCES users(telegram_id)
+        )
+    """)
+
+
+async def _m002_user_usage_rollup(db):
+    """ستون تجمیعی مصرف کاربر و تریگرهای نگهداری آن"""
+    if "used_traffic_gb" not in await _table_columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN used_traffic_gb REAL DEFAULT 0")
+    await _create_usage_triggers(db, "gb")
+
+
+def _config_usage(row: str, unit: str) -> str:
+    """سهم یک کانفیگ از مصرف کاربر با ستون‌های واحد داده شده (gb پیش از migration 9)"""
+    return (f"CASE WHEN {row}.is_deleted THEN {row}.deleted_traffic_{unit} "
+            f"ELSE {row}.traffic_used_{unit} END")
+
+
+async def _create_usage_triggers(db, unit: str):
+    """تریگرهای نگهداری users.used_traffic_{unit} از روی تغییرات configs"""
+    old, new = _config_usage("OLD", unit), _config_usage("NEW", unit)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS configs_usage_insert AFTER INSERT ON configs
+        BEGIN
+            UPDATE users SET used_traffic_{unit} = used_traffic_{unit} + ({new})
+            WHERE telegram_id = NEW.owner_telegram_id;
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS configs_usage_update
+        AFTER UPDATE OF traffic_used_{unit}, deleted_traffic_{unit}, is_deleted, owner_telegram_id
+        ON configs
+        WHEN ({old}) IS NOT ({new})
+             OR OLD.owner_telegram_id IS NOT NEW.owner_telegram_id
+        BEGIN
+            UPDATE users SET used_traffic_{unit} = used_traffic_{unit} - ({old})
+            WHERE telegram_id = OLD.owner_telegram_id;
+            UPDATE users SET used_traffic_{unit} = used_traffic_{unit} + ({new})
+            WHERE telegram_id = NEW.owner_telegram_id;
+        END
+    """)
+    await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS configs_usage_delete AFTER DELETE ON configs
+        BEGIN
+            UPDATE users SET used_traffic_{unit} = used_traffic_{unit} - ({old})
+            WHERE telegram_id = OLD.owner_telegram_id;
+        END
+    """)
+
+
+# مقداردهی ستون تجمیعی برای کاربران موجود (دسته‌ای روی rowid کاربران)
+_B002_USER_USAGE = f"""
+    UPDATE users SET used_traffic_gb = (
+        SELECT COALESCE(SUM({_config_usage("configs", "gb")}), 0)
+        FROM configs WHERE configs.owner_telegram_id = users.telegram_id
+    )
+    WHERE rowid > ? AND rowid <= ?
+"""
+
+
+async def _m003_config_indexes(db):
+    """ایندکس‌های جدول کانفیگ‌ها"""
+    # کانفیگ‌های یک کاربر (با یا بدون حذف شده‌ها)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_owner
+        ON configs(owner_telegram_id, is_deleted)
+    """)
+    
+    # کانفیگ‌های فعال - پوشش کامل کوئری همگام‌سازی ترافیک
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_active_traffic
+        ON configs(panel_client_email, id, owner_telegram_id, traffic_used_gb, is_deleted)
+        WHERE is_deleted = 0
+    """)
+    
+    # ایمیل کانفیگ یکتاست؛ اگر داده قدیمی تکراری دارد، ایندکس غیر یکتا ساخته می‌شود
+    async with db.execute("""
+        SELECT 1 FROM configs GROUP BY panel_client_email HAVING COUNT(*) > 1 LIMIT 1
+    """) as cursor:
+        has_duplicates = await cursor.fetchone() is not None
+    if has_duplicates:
+        print("Warning: duplicate config emails found, email index is not unique")
+        await db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_configs_email ON configs(panel_client_email)"
+        )
+    else:
+        await db.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_configs_email ON configs(panel_client_email)"
+        )
+
+
+async def _m004_configs_archive(db):
+    """جدول آرشیو کانفیگ‌های حذف شده و مجموع تاریخی مصرف کاربر"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS configs_archive (
+            id INTEGER PRIMARY KEY,
+            owner_telegram_id INTEGER NOT NULL,
+            panel_client_email TEXT NOT NULL,
+            inbound_id INTEGER NOT NULL,
+            traffic_limit_gb REAL NOT NULL,
+            traffic_used_gb REAL DEFAULT 0,
+            expiry_time INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            is_deleted BOOLEAN DEFAULT 1,
+            deleted_traffic_gb REAL DEFAULT 0,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_archive_owner
+        ON configs_archive(owner_telegram_id)
+    """)
+    
+    # کانفیگ‌های حذف شده در انتظار آرشیو
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_deleted
+        ON configs(id) WHERE is_deleted = 1
+    """)
+    
+    # مصرف کانفیگ‌های آرشیو شده (همچنان در used_traffic_gb هم حساب می‌شود)
+    if "archived_traffic_gb" not in await _table_columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN archived_traffic_gb REAL DEFAULT 0")
+
+
+async def _m005_alert_state(db):
+    """بالاترین سطح هشدار ترافیک ارسال شده برای هر کاربر"""
+    if "alert_tier" not in await _table_columns(db, "users"):
+        await db.execute("ALTER TABLE users ADD COLUMN alert_tier INTEGER DEFAULT 0")
+    
+    # تغییر حد مجاز یعنی دوره جدید - هشدارها دوباره فعال می‌شوند
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS users_alert_rearm
+        AFTER UPDATE OF traffic_limit_gb ON users
+        WHEN OLD.traffic_limit_gb IS NOT NEW.traffic_limit_gb
+        BEGIN
+            UPDATE users SET alert_tier = 0 WHERE telegram_id = NEW.telegram_id;
+        END
+    """)
+
+
+async def _m006_job_runs(db):
+    """سابقه اجرای jobهای زمان‌بندی شده"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS job_runs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            started_at INTEGER NOT NULL,
+            duration_seconds REAL NOT NULL,
+            fetch_seconds REAL,
+            matched INTEGER DEFAULT 0,
+            changed INTEGER DEFAULT 0,
+            error TEXT
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_job_runs_job ON job_runs(job, id)")
+
+
+async def _m007_config_suspension(db):
+    """وضعیت غیرفعال‌سازی خودکار کانفیگ در پنل"""
+    if "is_suspended" not in await _table_columns(db, "configs"):
+        await db.execute("ALTER TABLE configs ADD COLUMN is_suspended BOOLEAN DEFAULT 0")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_suspended
+        ON configs(owner_telegram_id) WHERE is_suspended = 1 AND is_deleted = 0
+    """)
+
+
+async def _m008_panels(db):
+    """ثبت پنل‌ها (نودها) و پنل محل هر کانفیگ"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS panels (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            url TEXT NOT NULL UNIQUE,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # پنل اصلی (شناسه 1) از تنظیمات - کانفیگ‌های موجود روی این پنل هستند
+    await db.execute("""
+        INSERT OR IGNORE INTO panels (id, name, url, username, password)
+        VALUES (1, 'main', ?, ?, ?)
+    """, (PANEL_URL.rstrip("/"), PANEL_USERNAME, PANEL_PASSWORD))
+    if "panel_id" not in await _table_columns(db, "configs"):
+        await db.execute("ALTER TABLE configs ADD COLUMN panel_id INTEGER NOT NULL DEFAULT 1")
+    if "panel_id" not in await _table_columns(db, "configs_archive"):
+        await db.execute("ALTER TABLE configs_archive ADD COLUMN panel_id INTEGER DEFAULT 1")
+    
+    # ایمیل کلاینت فقط داخل یک پنل معنی دارد - پوشش کوئری همگام‌سازی با panel_id
+    await db.execute("DROP INDEX IF EXISTS idx_configs_active_traffic")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_active_traffic
+        ON configs(panel_id, panel_client_email, id, owner_telegram_id, traffic_used_gb, is_deleted)
+        WHERE is_deleted = 0
+    """)
+
+
+async def _m009_traffic_bytes(db):
+    """شمارش ترافیک به بایت (عدد صحیح) به جای گیگابایت اعشاری گرد شده"""
+    # ستون‌های قدیمی تا وقتی تریگر یا ایندکسی به آن‌ها اشاره کند قابل حذف نیستند
+    for trigger in ("configs_usage_insert", "configs_usage_update", "configs_usage_delete"):
+        await db.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    await db.execute("DROP INDEX IF EXISTS idx_configs_active_traffic")
+    
+    renames = {
+        "configs": (("traffic_used_gb", "traffic_used_bytes"),
+                    ("deleted_traffic_gb", "deleted_traffic_bytes")),
+        "configs_archive": (("traffic_used_gb", "traffic_used_bytes"),
+                            ("deleted_traffic_gb", "deleted_traffic_bytes")),
+        "users": (("archived_traffic_gb", "archived_traffic_bytes"),
+                  ("used_traffic_gb", "used_traffic_bytes")),
+    }
+    for table, columns in renames.items():
+        existing = await _table_columns(db, table)
+        for old, new in columns:
+            if new not in existing:
+                await db.execute(
+                    f"ALTER TABLE {table} ADD COLUMN {new} INTEGER NOT NULL DEFAULT 0"
+                )
+            if old in existing:
+                await db.execute(f"""
+                    UPDATE {table}
+                    SET {new} = CAST(ROUND(MAX(COALESCE({old}, 0), 0) * {BYTES_PER_GB}) AS INTEGER)
+                """)
+                await db.execute(f"ALTER TABLE {table} DROP COLUMN {old}")
+    
+    # مجموع کاربر از روی بایت‌های تبدیل شده دوباره حساب می‌شود تا با جمع کانفیگ‌ها دقیقاً برابر باشد
+    # (جایگزین backfill احتمالاً ناتمام migration 2)
+    await db.execute(f"""
+        UPDATE users SET used_traffic_bytes = archived_traffic_bytes + (
+            SELECT COALESCE(SUM({_config_usage("configs", "bytes")}), 0)
+            FROM configs WHERE configs.owner_telegram_id = users.telegram_id
+        )
+    """)
+    await _set(db, _backfill_key(2), "done")
+    
+    await _create_usage_triggers(db, "bytes")
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_configs_active_traffic
+        ON configs(panel_id, panel_client_email, id, owner_telegram_id, traffic_used_bytes, is_deleted)
+        WHERE is_deleted = 0
+    """)
+
+
+async def _m010_usage_history(db):
+    """سابقه مصرف کانفیگ‌ها: نمونه‌های خام افزایشی و سطل‌های تجمیع شده"""
+    # هر ردیف افزایش مصرف کانفیگ نسبت به نمونه قبلی است (delta) - بدون rowid تا
+    # کلید اصلی خود جدول باشد و کوئری بازه زمانی فقط روی همین کلید اجرا شود
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_samples (
+            config_id INTEGER NOT NULL,
+            sampled_at INTEGER NOT NULL,
+            delta_bytes INTEGER NOT NULL,
+            PRIMARY KEY (config_id, sampled_at)
+        ) WITHOUT ROWID
+    """)
+    
+    # سطل‌های ساعتی (resolution = 3600) و روزانه (86400) حاصل تجمیع نمونه‌های قدیمی
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS usage_rollups (
+            config_id INTEGER NOT NULL,
+            resolution INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            bytes INTEGER NOT NULL,
+            PRIMARY KEY (config_id, resolution, bucket)
+        ) WITHOUT ROWID
+    """)
+    
+    # هر تغییر مصرف (همگام‌سازی یا بروزرسانی دستی) یک نمونه ثبت می‌کند؛
+    # کمتر شدن مصرف یعنی ریست ترافیک در پنل و مقدار جدید همان افزایش از ریست است
+    await db.execute("""
+        CREATE TRIGGER IF NOT EXISTS configs_usage_sample
+        AFTER UPDATE OF traffic_used_bytes ON configs
+        WHEN NEW.traffic_used_bytes IS NOT OLD.traffic_used_bytes
+        BEGIN
+            INSERT INTO usage_samples (config_id, sampled_at, delta_bytes)
+            VALUES (
+                NEW.id,
+                CAST(strftime('%s', 'now') AS INTEGER),
+                CASE WHEN NEW.traffic_used_bytes >= OLD.traffic_used_bytes
+                     THEN NEW.traffic_used_bytes - OLD.traffic_used_bytes
+                     ELSE NEW.traffic_used_bytes END
+            )
+            ON CONFLICT (config_id, sampled_at)
+            DO UPDATE SET delta_bytes = delta_bytes + excluded.delta_bytes;
+        END
+    """)
+
+
+# لیست مرتب migrationها: (نسخه، نام، تابع schema، backfill اختیاری به شکل (جدول، کوئری))
+# تابع schema در یک تراکنش همراه با ثبت نسخه اجرا می‌شود.
+# backfill روی جداول بزرگ به صورت دسته‌ای و در تراکنش‌های جدا اجرا و قابل ادامه است.
+MIGRATIONS = [
+    (1, "base_schema", _m001_base_schema, None),
+    (2, "user_usage_rollup", _m002_user_usage_rollup, ("users", _B002_USER_USAGE)),
+    (3, "config_indexes", _m003_config_indexes, None),
+    (4, "configs_archive", _m004_configs_archive, None),
+    (5, "alert_state", _m005_alert_state, None),
+    (6, "job_runs", _m006_job_runs, None),
+    (7, "config_suspension", _m007_config_suspension, None),
+    (8, "panels", _m008_panels, None),
+    (9, "traffic_bytes", _m009_traffic_bytes, None),
+    (10, "usage_history", _m010_usage_history, None),
+]
+
+
+# ==================== اجرای migrationها ====================
+
+async def _table_columns(db, table: str) -> list:
+    """نام ستون‌های یک جدول"""
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return [row[1] for row in await cursor.fetchall()]
+
+
+async def _set(db, key: str, value: str):
+    """ذخیره تنظیم داخل تراکنش جاری"""
+    await db.execute("""
+        INSERT INTO settings (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value
+    """, (key, value))
+
+
+async def get_schema_version() -> int:
+    """نسخه فعلی schema"""
+    return int(await get_setting(SCHEMA_VERSION_KEY, "0"))
+
+
+async def run_migrations():
+    """اجرای migrationهای اعمال نشده به ترتیب و سپس backfillهای ناتمام"""
+    async with transaction() as db:
+        # جدول تنظیمات محل نگهداری نسخه schema است
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        """)
+    
+    current = await get_schema_version()
+    
+    for version, name, apply, backfill in MIGRATIONS:
+        if version <= current:
+            continue
+        
+        started = time.monotonic()
+        async with transaction() as db:
+            await apply(db)
+            if backfill:
+                await _set(db, _backfill_key(version), "0")
+            await _set(db, SCHEMA_VERSION_KEY, str(version))
+            await _set(db, f"migration:{version}", json.dumps({
+                "name": name,
+                "applied_at": int(time.time()),
+                "seconds": round(time.monotonic() - started, 3)
+            }))
+        
+        print(f"[{datetime.now()}] Migration {version} ({name}) applied "
+              f"in {time.monotonic() - started:.2f}s")
+    
+    await _run_pending_backfills()
+
+
+def _backfill_key(version: int) -> str:
+    return f"migration:{version}:backfill"
+
+
+async def _run_pending_backfills():
+    """اجرای backfillهای ناتمام - در حالت آنلاین در پس‌زمینه"""
+    global _backfill_task
+    
+    pending = []
+    for version, name, _, backfill in MIGRATIONS:
+        if not backfill:
+            continue
+        progress = await get_setting(_backfill_key(version))
+        if progress is not None and progress != "done":
+            pending.append((version, name, backfill, int(progress)))
+    
+    if not pending:
+        return
+    
+    if DB_ONLINE_BACKFILL:
+        _backfill_task = asyncio.create_task(_run_backfills(pending))
+    else:
+        await _run_backfills(pending)
+
+
+async def _run_backfills(pending: list):
+    for version, name, (table, query), last_rowid in pending:
+        started = time.monotonic()
+        rows = await _backfill(version, table, query, last_rowid)
+        print(f"[{datetime.now()}] Backfill of migration {version} ({name}) finished: "
+              f"{rows} rows in {time.monotonic() - started:.2f}s")
+
+
+async def _backfill(version: int, table: str, query: str, last_rowid: int) -> int:
+    """اجرای کوئری backfill روی بازه‌های rowid - هر دسته در یک تراکنش جدا با ثبت پیشرفت"""
+    db = await get_db()
+    async with db.execute(f"SELECT MAX(rowid) FROM {table}") as cursor:
+        max_rowid = (await cursor.fetchone())[0] or 0
+    
+    rows = 0
+    while last_rowid < max_rowid:
+        upper = last_rowid + DB_BACKFILL_BATCH_SIZE
+        async with transaction() as db:
+            cursor = await db.execute(query, (last_rowid, upper))
+            rows += max(cursor.rowcount, 0)
+            await _set(db, _backfill_key(version), str(upper))
+        last_rowid = upper
+        # فرصت اجرا به سایر درخواست‌ها بین دسته‌ها
+        await asyncio.sleep(0)
+    
+    async with transaction() as db:
+        await _set(db, _backfill_key(version), "done")
+    return rows
+
+
+async def cancel_backfills():
+    """توقف backfill آنلاین در حال اجرا (پیشرفت ذخیره شده و در اجرای بعد ادامه می‌یابد)"""
+    global _backfill_task
+    if _backfill_task and not _backfill_task.done():
+        _backfill_task.cancel()
+        try:
+            await _backfill_task
+        except asyncio.CancelledError:
+            pass
+    _backfill_task = None
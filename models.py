@@ -0,0 +1,152 @@
+# مدل‌های فشرده داده (با __slots__) برای مسیرهای پرتکرار
+
+# ترافیک در دیتابیس و همگام‌سازی به بایت (عدد صحیح) است و فقط هنگام نمایش به گیگابایت تبدیل می‌شود
+BYTES_PER_GB = 1024 ** 3
+
+
+def bytes_to_gb(value: int) -> float:
+    """تبدیل بایت به گیگابایت برای نمایش"""
+    return (value or 0) / BYTES_PER_GB
+
+
+class Record:
+    """پایه رکوردهای فشرده - دسترسی به شکل dict (record["x"] و get) هم پشتیبانی می‌شود"""
+    __slots__ = ()
+    
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+    
+    @classmethod
+    def from_row(cls, row) -> "Record":
+        """ساخت از یک ردیف SQLite (ستون‌های ناشناخته نادیده گرفته می‌شوند)"""
+        return cls.from_rows([row])[0]
+    
+    @classmethod
+    def from_rows(cls, rows) -> list:
+        """ساخت از ردیف‌های یک کوئری - نام ستون‌ها فقط یک بار خوانده می‌شود"""
+        if not rows:
+            return []
+        slots = set(cls.__slots__)
+        columns = [
+            (i, name) for i, name in enumerate(rows[0].keys()) if name in slots
+        ]
+        missing = [name for name in cls.__slots__ if name not in {c[1] for c in columns}]
+        
+        records = []
+        for row in rows:
+            record = cls.__new__(cls)
+            for i, name in columns:
+                setattr(record, name, row[i])
+            for name in missing:
+                setattr(record, name, None)
+            records.append(record)
+        return records
+    
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+    
+    def get(self, key: str, default=None):
+        value = getattr(self, key, None)
+        return default if value is None else value
+    
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+    
+    def keys(self) -> tuple:
+        return self.__slots__
+    
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+    
+    def __eq__(self, other) -> bool:
+        return type(other) is type(self) and self.to_dict() == other.to_dict()
+    
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+# ==================== رکوردهای پنل ====================
+
+class ClientStat(Record):
+    """آمار ترافیک یک کلاینت در پاسخ پنل (clientStats) - حجم به بایت"""
+    __slots__ = ("email", "inbound_id", "enable", "up", "down")
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "ClientStat":
+        stat = cls.__new__(cls)
+        stat.email = data.get("email")
+        stat.inbound_id = data.get("inboundId")
+        stat.enable = data.get("enable", True)
+        stat.up = data.get("up", 0)
+        stat.down = data.get("down", 0)
+        return stat
+
+
+class Inbound(Record):
+    """inbound پنل - settings و streamSettings به صورت رشته نگهداری و فقط هنگام نیاز پارس می‌شوند"""
+    __slots__ = ("id", "remark", "protocol", "port", "enable",
+                 "settings", "streamSettings", "clientStats")
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "Inbound":
+        inbound = cls.__new__(cls)
+        inbound.id = data.get("id")
+        inbound.remark = data.get("remark")
+        inbound.protocol = data.get("protocol")
+        inbound.port = data.get("port")
+        inbound.enable = data.get("enable", True)
+        inbound.settings = data.get("settings")
+        inbound.streamSettings = data.get("streamSettings")
+        # پارس تدریجی لیست، clientStats را از قبل عنصر به عنصر تبدیل کرده است
+        inbound.clientStats = tuple(
+            stat if isinstance(stat, ClientStat) else ClientStat.from_json(stat)
+            for stat in data.get("clientStats") or ()
+        )
+        return inbound
+
+
+class Client(Record):
+    """کلاینت داخل settings یک inbound"""
+    __slots__ = ("id", "password", "email", "flow", "alterId", "security", "method",
+                 "subId", "limitIp", "totalGB", "expiryTime", "enable")
+    
+    @classmethod
+    def from_json(cls, data: dict) -> "Client":
+        client = cls.__new__(cls)
+        for name in cls.__slots__:
+            setattr(client, name, data.get(name))
+        return client
+
+
+class ClientTraffic(Record):
+    """ترافیک یک کلاینت (بایت) - خروجی get_all_clients_traffic"""
+    __slots__ = ("email", "inbound_id", "enable", "upload_bytes", "download_bytes", "total_bytes")
+    
+    def __init__(self, email: str, inbound_id: int, enable: bool,
+                 upload_bytes: int, download_bytes: int):
+        self.email = email
+        self.inbound_id = inbound_id
+        self.enable = enable
+        self.upload_bytes = upload_bytes
+        self.download_bytes = download_bytes
+        self.total_bytes = upload_bytes + download_bytes
+
+
+# ==================== رکوردهای دیتابیس ====================
+
+class User(Record):
+    """ردیف جدول users"""
+    __slots__ = ("telegram_id", "is_admin", "is_sudo", "traffic_limit_gb", "is_blocked",
+                 "created_at", "used_traffic_bytes", "archived_traffic_bytes", "alert_tier")
+
+
+class Config(Record):
+    """ردیف جدول configs (یا configs_archive)"""
+    __slots__ = ("id", "owner_telegram_id", "panel_client_email", "inbound_id",
+                 "traffic_limit_gb", "traffic_used_bytes", "expiry_time", "created_at",
+                 "is_deleted", "deleted_traffic_bytes", "is_suspended", "panel_id")
@@ -0,0 +1,99 @@
+# ارسال پیام‌های گروهی با رعایت محدودیت نرخ تلگرام
+
+import asyncio
+import time
+from datetime import datetime
+from telegram import Bot
+from telegram.error import RetryAfter, Forbidden, BadRequest, TelegramError
+
+from config import (
+    NOTIFY_RATE_PER_SECOND, NOTIFY_PER_CHAT_INTERVAL_SECONDS,
+    NOTIFY_WORKERS, NOTIFY_MAX_RETRIES
+)
+
+
+# حداکثر طول متن یک پیام تلگرام
+MAX_MESSAGE_LENGTH = 4096
+
+
+class NotificationDispatcher:
+    """صف ارسال پیام با سقف نرخ کلی، فاصله هر چت و تلاش مجدد روی RetryAfter"""
+    
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._interval = 1 / NOTIFY_RATE_PER_SECOND
+        self._next_slot = 0.0
+        self._slot_lock = asyncio.Lock()
+        self._chat_next: dict = {}
+    
+    async def _wait_slot(self, chat_id: int):
+        """انتظار تا نوبت ارسال بعدی (کلی و برای هر چت)"""
+        async with self._slot_lock:
+            now = time.monotonic()
+            at = max(now, self._next_slot, self._chat_next.get(chat_id, 0))
+            self._next_slot = at + self._interval
+            self._chat_next[chat_id] = at + NOTIFY_PER_CHAT_INTERVAL_SECONDS
+        
+        if at > now:
+            await asyncio.sleep(at - now)
+    
+    def _pause(self, seconds: float):
+        """عقب انداختن همه ارسال‌ها (محدودیت flood تلگرام)"""
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+    
+    async def _send(self, chat_id: int, text: str) -> bool:
+        for attempt in range(NOTIFY_MAX_RETRIES + 1):
+            await self._wait_slot(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True
+            except RetryAfter as e:
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                self._pause(retry_after)
+            except (Forbidden, BadRequest) as e:
+                # کاربر ربات را بلاک کرده یا چت نامعتبر است - تلاش مجدد فایده‌ای ندارد
+                print(f"[{datetime.now()}] Failed to send message to {chat_id}: {e}")
+                return False
+            except TelegramError as e:
+                if attempt == NOTIFY_MAX_RETRIES:
+                    print(f"[{datetime.now()}] Failed to send message to {chat_id}: {e}")
+                    return False
+                # backoff نمایی برای خطاهای شبکه
+                await asyncio.sleep(2 ** attempt)
+        
+        print(f"[{datetime.now()}] Failed to send message to {chat_id}: retries exhausted")
+        return False
+    
+    async def send_all(self, messages: list) -> dict:
+        """ارسال لیست (chat_id, text) به صورت موازی - خروجی: تعداد موفق و ناموفق"""
+        queue = asyncio.Queue()
+        for message in messages:
+            queue.put_nowait(message)
+        
+        result = {"sent": 0, "failed": 0}
+        
+        async def worker():
+            while not queue.empty():
+                chat_id, text = queue.get_nowait()
+                if await self._send(chat_id, text):
+                    result["sent"] += 1
+                else:
+                    result["failed"] += 1
+        
+        await asyncio.gather(*(worker() for _ in range(min(NOTIFY_WORKERS, len(messages)))))
+        return result
+
+
+def split_message(header: str, lines: list) -> list:
+    """تقسیم یک پیام طولانی به چند پیام در حد مجاز طول تلگرام"""
+    messages = []
+    current = header
+    for line in lines:
+        if len(current) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            messages.append(current)
+            current = header
+        current += "\n" + line
+    messages.append(current)
+    return messages
@@ -1,27 +1,49 @@
 # تسک‌های زمان‌بندی شده
 
 import asyncio
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
 from telegram import Bot
 
 from config import (
-    BOT_TOKEN, SUDO_ADMIN_ID, TRAFFIC_CHECK_INTERVAL_HOURS,
-    ALERT_THRESHOLD_PERCENT, MESSAGES
+    BOT_TOKEN, SUDO_ADMIN_ID, TRAFFIC_CHECK_INTERVAL_HOURS, TRAFFIC_CHECK_MIN_MINUTES,
+    ARCHIVE_INTERVAL_HOURS, ARCHIVE_BATCH_SIZE,
+    ALERT_THRESHOLD_TIERS, MESSAGES,
+    ENFORCE_QUOTAS, ENFORCE_BATCH_SIZE, ENFORCE_CONCURRENCY,
+    USAGE_ROLLUP_INTERVAL_HOURS, USAGE_RAW_RETENTION_HOURS,
+    USAGE_HOURLY_RETENTION_DAYS, USAGE_DAILY_RETENTION_DAYS
 )
 from database import (
-    get_all_active_configs, update_config_traffic,
-    get_all_users, get_user_total_traffic, get_users_near_limit,
-    get_user
+    get_all_users, get_user_total_traffic, get_users_alert_state, set_users_alert_tier,
+    get_user, get_active_configs_traffic, get_users_configs_traffic, update_configs_traffic,
+    archive_deleted_configs, add_job_run,
+    get_configs_to_suspend, get_configs_to_resume, set_configs_suspended,
+    rollup_usage_samples
 )
-from api import Panel3XUI
+from api import get_panel, get_panels, init_panel
+from notifier import NotificationDispatcher, split_message
+from models import BYTES_PER_GB, bytes_to_gb
 
 
 # نگهداری bot instance
 bot: Bot = None
 scheduler: AsyncIOScheduler = None
 
+# اجراهای در حال انجام: نام job -> Task
+_running: dict = {}
+
+# قفل مشترک اجراهای غیرفعال‌سازی خودکار
+_enforce_lock = asyncio.Lock()
+
+# نمونه آخر مصرف هر کاربر برای تخمین سرعت مصرف: telegram_id -> (زمان، مصرف بایت، سرعت بایت بر ثانیه)
+_usage_samples: dict = {}
+
+# کاربران پرمصرفی که بین همگام‌سازی‌های کامل جداگانه بررسی می‌شوند
+_hot_users: set = set()
+
 
 def init_scheduler(bot_instance: Bot):
     """راه‌اندازی scheduler"""
@@ -30,87 +52,464 @@ def init_scheduler(bot_instance: Bot):
     bot = bot_instance
     scheduler = AsyncIOScheduler()
     
-    # اضافه کردن job چک ترافیک
+    # اضافه کردن job همگام‌سازی کامل ترافیک - اولین اجرا زود برای گرفتن نمونه مصرف؛
+    # کاربران پرمصرف بین اجراها با job جداگانه hot_traffic_check بررسی می‌شوند
     scheduler.add_job(
         check_all_traffic,
         IntervalTrigger(hours=TRAFFIC_CHECK_INTERVAL_HOURS),
         id="traffic_check",
         name="Traffic Check Job",
+        next_run_time=datetime.now() + timedelta(minutes=TRAFFIC_CHECK_MIN_MINUTES),
+        replace_existing=True
+    )
+    
+    # اضافه کردن job آرشیو کانفیگ‌های حذف شده
+    scheduler.add_job(
+        archive_configs,
+        IntervalTrigger(hours=ARCHIVE_INTERVAL_HOURS),
+        id="configs_archive",
+        name="Configs Archive Job",
+        replace_existing=True
+    )
+    
+    # اضافه کردن job تجمیع سابقه مصرف
+    scheduler.add_job(
+        rollup_usage_history,
+        IntervalTrigger(hours=USAGE_ROLLUP_INTERVAL_HOURS),
+        id="usage_rollup",
+        name="Usage Rollup Job",
         replace_existing=True
     )
     
     scheduler.start()
-    print(f"✅ Scheduler started. Traffic check every {TRAFFIC_CHECK_INTERVAL_HOURS} hours.")
+    print(f"✅ Scheduler started. Full traffic sync every {TRAFFIC_CHECK_INTERVAL_HOURS} hours, "
+          f"heavy users every {TRAFFIC_CHECK_MIN_MINUTES} minutes or more.")
+
+
+async def _single_flight(name: str, job):
+    """اجرای یک job به صورت تکی - فراخوانی‌های همزمان به اجرای در حال انجام می‌پیوندند"""
+    task = _running.get(name)
+    if task is None or task.done():
+        task = asyncio.create_task(job())
+        _running[name] = task
+    # لغو یکی از منتظرها اجرای مشترک را لغو نمی‌کند
+    return await asyncio.shield(task)
+
+
+async def sync_traffic() -> dict:
+    """همگام‌سازی افزایشی ترافیک - فقط کانفیگ‌هایی که تغییر کرده‌اند نوشته می‌شوند"""
+    return await _single_flight("traffic_sync", _sync_traffic)
+
+
+async def _sync_traffic() -> dict:
+    started_at = int(time.time())
+    started = time.monotonic()
+    fetch_seconds = None
+    matched = changed = 0
+    error = None
+    
+    try:
+        # دریافت همزمان ترافیک همه کلاینت‌ها از همه پنل‌ها
+        panels = get_panels() or await init_panel()
+        results = await asyncio.gather(
+            *(panel.get_all_clients_traffic() for panel in panels),
+            return_exceptions=True
+        )
+        fetch_seconds = time.monotonic() - started
+        
+        # خطای یک پنل مانع همگام‌سازی بقیه نمی‌شود
+        failures = [
+            f"{panel.name}: {result}" for panel, result in zip(panels, results)
+            if isinstance(result, Exception)
+        ]
+        if failures:
+            error = "; ".join(failures)
+            print(f"[{datetime.now()}] Traffic fetch failed for {error}")
+            if len(failures) == len(panels):
+                raise RuntimeError(error)
+        
+        # ترافیک ذخیره شده از همگام‌سازی قبلی
+        stored = await get_active_configs_traffic()
+        
+        updates = []
+        changed_owners = set()
+        
+        for panel, all_traffic in zip(panels, results):
+            if isinstance(all_traffic, Exception):
+                continue
+            for traffic in all_traffic:
+                entry = stored.get((panel.panel_id, traffic.email))
+                if entry is None:
+                    continue
+                
+                matched += 1
+                config_id, owner_id, used_bytes = entry
+                if traffic.total_bytes != used_bytes:
+                    updates.append((config_id, traffic.total_bytes))
+                    changed_owners.add(owner_id)
+        
+        # نوشتن همه تغییرات در یک تراکنش
+        changed = await update_configs_traffic(updates)
+        
+        return {
+            "matched": matched,
+            "changed": changed,
+            "changed_owners": changed_owners,
+            "error": error
+        }
+    except Exception as e:
+        error = error or str(e)
+        raise
+    finally:
+        await add_job_run(
+            "traffic_sync", started_at, time.monotonic() - started,
+            fetch_seconds, matched, changed, error
+        )
 
 
 async def check_all_traffic():
     """بررسی ترافیک همه کانفیگ‌ها"""
+    await _single_flight("traffic_check", _check_all_traffic)
+
+
+async def _check_all_traffic():
     print(f"[{datetime.now()}] Starting traffic check...")
     
     try:
-        async with Panel3XUI() as panel:
-            # دریافت ترافیک همه کلاینت‌ها
-            all_traffic = await panel.get_all_clients_traffic()
-            
-            # ساخت دیکشنری برای دسترسی سریع
-            traffic_by_email = {t["email"]: t for t in all_traffic}
-            
-            # بروزرسانی ترافیک در دیتابیس
-            configs = await get_all_active_configs()
-            
-            for config in configs:
-                email = config.get("panel_client_email")
-                if email in traffic_by_email:
-                    traffic_gb = traffic_by_email[email].get("total_gb", 0)
-                    await update_config_traffic(config["id"], traffic_gb)
+        result = await sync_traffic()
         
-        print(f"[{datetime.now()}] Updated traffic for {len(configs)} configs.")
+        print(f"[{datetime.now()}] Traffic synced: {result['matched']} configs, "
+              f"{result['changed']} changed.")
         
-        # بررسی کاربران نزدیک به حد مجاز
-        await check_users_near_limit()
+        # بررسی حد مجاز فقط برای کاربرانی که مصرفشان تغییر کرده
+        # (خطای ارسال هشدار مانع غیرفعال‌سازی و زمان‌بندی چک بعدی نمی‌شود)
+        try:
+            await check_users_near_limit(result["changed_owners"])
+        except Exception as e:
+            print(f"[{datetime.now()}] Error sending traffic alerts: {e}")
+        
+        # غیرفعال‌سازی کلاینت‌های بیش از حد مجاز یا منقضی (در صورت فعال بودن ENFORCE_QUOTAS)
+        await enforce_quotas()
+        
+        await schedule_hot_check()
         
     except Exception as e:
         print(f"[{datetime.now()}] Error in traffic check: {e}")
 
 
-async def check_users_near_limit():
-    """بررسی و هشدار کاربران نزدیک به حد مجاز"""
-    users_near_limit = await get_users_near_limit(ALERT_THRESHOLD_PERCENT)
+async def _estimate_check_delays(telegram_ids: set = None) -> dict:
+    """فاصله مناسب چک بعدی هر کاربر (ثانیه) - نصف زمان تخمینی رسیدن به سطح هشدار بعدی
     
-    for user_data in users_near_limit:
-        telegram_id = user_data["telegram_id"]
-        percent = user_data["percent"]
-        used_gb = user_data["used_gb"]
-        limit_gb = user_data["limit_gb"]
+    فقط کاربرانی که مصرف اخیر دارند و سطح هشدار بعدی برایشان وجود دارد برگردانده می‌شوند.
+    """
+    now = time.time()
+    delays = {}
+    
+    for state in await get_users_alert_state(telegram_ids):
+        telegram_id = state["telegram_id"]
+        used = state["used_bytes"]
+        
+        rate = 0
+        previous = _usage_samples.get(telegram_id)
+        if previous and now > previous[0]:
+            # میانگین هموار سرعت مصرف (بایت بر ثانیه) بین دو همگام‌سازی
+            current_rate = max(0, used - previous[1]) / (now - previous[0])
+            rate = (current_rate + previous[2]) / 2
+        _usage_samples[telegram_id] = (now, used, rate)
+        
+        next_tier = next((t for t in ALERT_THRESHOLD_TIERS if t > state["percent"]), None)
+        if rate <= 0 or next_tier is None or state["limit_gb"] <= 0:
+            continue
+        
+        remaining = next_tier * state["limit_gb"] * BYTES_PER_GB // 100 - used
+        delays[telegram_id] = remaining / rate / 2
+    
+    return delays
+
+
+async def schedule_hot_check(telegram_ids: set = None):
+    """زمان‌بندی چک کاربرانی که پیش از همگام‌سازی کامل بعدی به سطح هشدار بعدی می‌رسند
+    
+    همگام‌سازی کامل با فاصله ثابت TRAFFIC_CHECK_INTERVAL_HOURS می‌ماند و این چک فقط
+    کلاینت‌های همین کاربران را می‌گیرد، پس بار پنل با تعداد کاربران پرمصرف رشد می‌کند نه کل کاربران.
+    """
+    full_interval = TRAFFIC_CHECK_INTERVAL_HOURS * 3600
+    delays = {
+        telegram_id: delay
+        for telegram_id, delay in (await _estimate_check_delays(telegram_ids)).items()
+        if delay < full_interval
+    }
+    _hot_users.clear()
+    _hot_users.update(delays)
+    
+    if not scheduler:
+        return
+    if not delays:
+        if scheduler.get_job("hot_traffic_check"):
+            scheduler.remove_job("hot_traffic_check")
+        return
+    
+    delay = max(min(delays.values()), TRAFFIC_CHECK_MIN_MINUTES * 60)
+    scheduler.add_job(
+        check_hot_traffic,
+        DateTrigger(run_date=datetime.now() + timedelta(seconds=int(delay))),
+        id="hot_traffic_check",
+        name="Hot Traffic Check Job",
+        replace_existing=True
+    )
+    print(f"[{datetime.now()}] Next check of {len(delays)} heavy users "
+          f"in {delay / 60:.0f} minutes.")
+
+
+async def check_hot_traffic():
+    """چک ترافیک کاربران پرمصرف بین همگام‌سازی‌های کامل"""
+    await _single_flight("hot_traffic_check", _check_hot_traffic)
+
+
+async def _check_hot_traffic():
+    full_sync = _running.get("traffic_sync")
+    if not _hot_users or (full_sync is not None and not full_sync.done()):
+        # همگام‌سازی کامل در حال اجرا خودش چک بعدی را زمان‌بندی می‌کند
+        return
+    
+    telegram_ids = set(_hot_users)
+    try:
+        result = await _sync_users_traffic(telegram_ids)
+        
+        print(f"[{datetime.now()}] Heavy users traffic synced: {result['matched']} configs, "
+              f"{result['changed']} changed.")
         
         try:
-            # ارسال هشدار به کاربر
-            user_message = MESSAGES["alert_near_limit"].format(
-                percent=percent,
-                used=used_gb,
-                limit=limit_gb
-            )
-            
-            await bot.send_message(
-                chat_id=telegram_id,
-                text=user_message
-            )
-            
-            # ارسال هشدار به ادمین اصلی
-            admin_message = MESSAGES["admin_alert"].format(
-                user_id=telegram_id,
-                percent=percent
-            )
-            
-            await bot.send_message(
-                chat_id=SUDO_ADMIN_ID,
-                text=admin_message
-            )
-            
-            print(f"[{datetime.now()}] Alert sent to user {telegram_id} ({percent}%)")
-            
+            await check_users_near_limit(result["changed_owners"])
         except Exception as e:
-            print(f"[{datetime.now()}] Failed to send alert to {telegram_id}: {e}")
+            print(f"[{datetime.now()}] Error sending traffic alerts: {e}")
+        
+        await enforce_quotas()
+        
+    except Exception as e:
+        print(f"[{datetime.now()}] Error in heavy users traffic check: {e}")
+    
+    await schedule_hot_check(telegram_ids)
+
+
+async def _sync_users_traffic(telegram_ids: set) -> dict:
+    """همگام‌سازی ترافیک کانفیگ‌های کاربران مشخص - فقط کلاینت‌های همین کاربران از پنل گرفته می‌شوند"""
+    started_at = int(time.time())
+    started = time.monotonic()
+    fetch_seconds = None
+    matched = changed = 0
+    error = None
+    
+    try:
+        stored = await get_users_configs_traffic(telegram_ids)
+        emails_by_panel = {}
+        for panel_id, email in stored:
+            emails_by_panel.setdefault(panel_id, []).append(email)
+        
+        # از کش لیست یا getClientTraffics جداگانه (get_clients_traffic)
+        panels = [panel for panel in get_panels() if panel.panel_id in emails_by_panel]
+        results = await asyncio.gather(
+            *(panel.get_clients_traffic(emails_by_panel[panel.panel_id]) for panel in panels),
+            return_exceptions=True
+        )
+        fetch_seconds = time.monotonic() - started
+        
+        failures = [
+            f"{panel.name}: {result}" for panel, result in zip(panels, results)
+            if isinstance(result, Exception)
+        ]
+        if failures:
+            error = "; ".join(failures)
+            print(f"[{datetime.now()}] Traffic fetch failed for {error}")
+        
+        updates = []
+        changed_owners = set()
+        
+        for panel, all_traffic in zip(panels, results):
+            if isinstance(all_traffic, Exception):
+                continue
+            for email, total_bytes in all_traffic.items():
+                matched += 1
+                config_id, owner_id, used_bytes = stored[(panel.panel_id, email)]
+                if total_bytes != used_bytes:
+                    updates.append((config_id, total_bytes))
+                    changed_owners.add(owner_id)
+        
+        changed = await update_configs_traffic(updates)
+        
+        return {
+            "matched": matched,
+            "changed": changed,
+            "changed_owners": changed_owners,
+            "error": error
+        }
+    except Exception as e:
+        error = error or str(e)
+        raise
+    finally:
+        await add_job_run(
+            "traffic_sync_hot", started_at, time.monotonic() - started,
+            fetch_seconds, matched, changed, error
+        )
+
+
+async def check_users_near_limit(telegram_ids: set = None):
+    """بررسی و هشدار کاربران نزدیک به حد مجاز - هر سطح هشدار فقط یک بار ارسال می‌شود"""
+    if telegram_ids is not None and not telegram_ids:
+        return
+    
+    users_near_limit = []
+    tier_updates = []
+    for user_data in await get_users_alert_state(telegram_ids):
+        tier = max((t for t in ALERT_THRESHOLD_TIERS if user_data["percent"] >= t), default=0)
+        if tier != user_data["alert_tier"]:
+            # کاهش مصرف سطح را پایین می‌آورد تا هشدار دوباره فعال شود
+            tier_updates.append((user_data["telegram_id"], tier))
+        if tier > user_data["alert_tier"]:
+            users_near_limit.append(user_data)
+    
+    if not users_near_limit:
+        await set_users_alert_tier(tier_updates)
+        return
+    
+    messages = []
+    admin_lines = []
+    for user_data in users_near_limit:
+        # هشدار کاربر
+        messages.append((user_data["telegram_id"], MESSAGES["alert_near_limit"].format(
+            percent=user_data["percent"],
+            used=round(bytes_to_gb(user_data["used_bytes"]), 2),
+            limit=user_data["limit_gb"]
+        )))
+        admin_lines.append(MESSAGES["admin_alert_line"].format(
+            user_id=user_data["telegram_id"],
+            percent=user_data["percent"],
+            used=round(bytes_to_gb(user_data["used_bytes"]), 2),
+            limit=user_data["limit_gb"]
+        ))
+    
+    # همه هشدارهای ادمین در یک پیام خلاصه
+    header = MESSAGES["admin_alert_digest"].format(count=len(admin_lines))
+    for text in split_message(header, admin_lines):
+        messages.append((SUDO_ADMIN_ID, text))
+    
+    result = await NotificationDispatcher(bot).send_all(messages)
+    print(f"[{datetime.now()}] Alerts sent for {len(users_near_limit)} users "
+          f"({result['sent']} sent, {result['failed']} failed)")
+    
+    # سطح‌ها بعد از ارسال ذخیره می‌شوند تا خطا در ساخت یا ارسال پیام هشدار را از بین نبرد
+    await set_users_alert_tier(tier_updates)
+
+
+async def enforce_quotas(owner_telegram_id: int = None) -> dict:
+    """غیرفعال کردن کلاینت‌های کاربران بیش از حد مجاز و کانفیگ‌های منقضی در پنل
+    و فعال کردن دوباره آن‌ها وقتی دلیل غیرفعال بودن برطرف شد (افزایش حد یا تمدید)
+    """
+    if not ENFORCE_QUOTAS:
+        return {"suspended": 0, "resumed": 0}
+    if owner_telegram_id is not None:
+        return await _single_flight(
+            f"quota_enforce:{owner_telegram_id}",
+            lambda: _enforce_quotas_serialized(owner_telegram_id)
+        )
+    return await _single_flight("quota_enforce", _enforce_quotas_serialized)
+
+
+async def _enforce_quotas_serialized(owner_telegram_id: int = None) -> dict:
+    """اجرای کلی و اجراهای هر کاربر پشت سر هم تا یک کلاینت همزمان دو بار تغییر نکند"""
+    async with _enforce_lock:
+        return await _enforce_quotas(owner_telegram_id)
+
+
+async def _enforce_quotas(owner_telegram_id: int = None) -> dict:
+    now = int(time.time())
+    to_suspend = await get_configs_to_suspend(now, owner_telegram_id)
+    to_resume = await get_configs_to_resume(now, owner_telegram_id)
+    if not to_suspend and not to_resume:
+        return {"suspended": 0, "resumed": 0}
+    
+    suspended = await _set_clients_enabled(to_suspend, False)
+    resumed = await _set_clients_enabled(to_resume, True)
+    
+    # اطلاع‌رسانی به مالک کانفیگ‌ها - یک پیام برای هر کاربر
+    messages = []
+    for key, configs in (("configs_suspended", suspended), ("configs_resumed", resumed)):
+        counts = {}
+        for config in configs:
+            counts[config["owner_telegram_id"]] = counts.get(config["owner_telegram_id"], 0) + 1
+        for telegram_id, count in counts.items():
+            messages.append((telegram_id, MESSAGES[key].format(count=count)))
+    if messages and bot:
+        await NotificationDispatcher(bot).send_all(messages)
+    
+    print(f"[{datetime.now()}] Quota enforcement: {len(suspended)} suspended, "
+          f"{len(resumed)} resumed.")
+    return {"suspended": len(suspended), "resumed": len(resumed)}
+
+
+async def _set_clients_enabled(configs: list, enable: bool) -> list:
+    """فعال/غیرفعال کردن کلاینت‌ها در دسته‌ها با تعداد درخواست همزمان محدود
+    
+    در هر دسته، هر inbound فقط یک بار از پنل گرفته و کش لیست هر پنل یک بار باطل می‌شود.
+    """
+    done = []
+    for i in range(0, len(configs), ENFORCE_BATCH_SIZE):
+        batch = configs[i:i + ENFORCE_BATCH_SIZE]
+        groups = {}
+        for config in batch:
+            groups.setdefault((config["panel_id"], config["inbound_id"]), []).append(config)
+        
+        batch_done = []
+        changed_panels = set()
+        for (panel_id, inbound_id), group in groups.items():
+            try:
+                panel = await get_panel(panel_id)
+                results = await panel.set_clients_enabled(
+                    inbound_id, [config["panel_client_email"] for config in group],
+                    enable, ENFORCE_CONCURRENCY
+                )
+            except Exception as e:
+                print(f"[{datetime.now()}] Failed to update clients of inbound "
+                      f"{inbound_id} on panel {panel_id}: {e}")
+                continue
+            
+            if any(results.values()):
+                changed_panels.add(panel)
+            for config in group:
+                result = results[config["panel_client_email"]]
+                if result is None:
+                    # کلاینت خارج از ربات حذف شده - چیزی برای مصرف باقی نمانده
+                    print(f"[{datetime.now()}] Client {config['panel_client_email']} "
+                          f"not found on panel")
+                if result is not False:
+                    batch_done.append(config)
+        
+        for panel in changed_panels:
+            panel.invalidate_inbounds()
+        # ثبت پیشرفت پس از هر دسته
+        await set_configs_suspended([config["id"] for config in batch_done], not enable)
+        done.extend(batch_done)
+    return done
+
+
+async def archive_configs():
+    """انتقال کانفیگ‌های حذف شده از جدول اصلی به آرشیو"""
+    archived = await archive_deleted_configs(ARCHIVE_BATCH_SIZE)
+    if archived:
+        print(f"[{datetime.now()}] Archived {archived} deleted configs.")
+
+
+async def rollup_usage_history():
+    """تجمیع نمونه‌های خام مصرف در سطل‌های ساعتی و روزانه و حذف سابقه منقضی"""
+    result = await rollup_usage_samples(
+        int(time.time()),
+        USAGE_RAW_RETENTION_HOURS * 3600,
+        USAGE_HOURLY_RETENTION_DAYS * 86400,
+        USAGE_DAILY_RETENTION_DAYS * 86400
+    )
+    if any(result.values()):
+        print(f"[{datetime.now()}] Usage history rolled up: {result['samples']} samples, "
+              f"{result['hours']} hourly buckets, {result['days_expired']} expired days.")
 
 
 async def manual_traffic_sync():
@@ -11,6 +11,7 @@ from urllib.parse import quote
 # اضافه کردن مسیر پروژه
 sys.path.append('/root/3xui-bot')
 from api import Panel3XUI
+from database import close_db
 
 
 async def test_panel_compatibility():
@@ -175,6 +176,14 @@ async def test_different_protocols():
                     print(f"   ❌ خطا: {str(e)}")
 
 
+async def main():
+    """اجرای تست‌ها و بستن اتصال دیتابیس (کوکی پنل در آن ذخیره می‌شود)"""
+    try:
+        await test_panel_compatibility()
+        await test_different_protocols()
+    finally:
+        await close_db()
+
+
 if __name__ == "__main__":
-    asyncio.run(test_panel_compatibility())
-    asyncio.run(test_different_protocols())
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,20 @@
+# تنظیمات مشترک تست‌ها
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """دیتابیس موقت برای هر تست - اتصال مشترک در پایان بسته می‌شود"""
+    path = str(tmp_path / "test.db")
+    monkeypatch.setattr(database, "DATABASE_PATH", path)
+    yield path
+    asyncio.run(database.close_db())
@@ -0,0 +1,63 @@
+# تست migrationهای دیتابیس
+
+import asyncio
+
+import pytest
+
+import database
+import migrations
+
+
+def _tables(db) -> set:
+    async def names():
+        async with db.execute("SELECT name FROM sqlite_master") as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+    return names()
+
+
+def test_failed_migration_rolls_back_ddl(db_path, monkeypatch):
+    async def broken(db):
+        await db.execute("CREATE TABLE half_applied (id INTEGER)")
+        raise RuntimeError("boom")
+    
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:1] + [
+        (2, "broken", broken, None)
+    ])
+    
+    async def run():
+        with pytest.raises(RuntimeError):
+            await database.init_db()
+        db = await database.get_db()
+        assert "half_applied" not in await _tables(db)
+        assert await migrations.get_schema_version() == 1
+    
+    asyncio.run(run())
+
+
+async def _plan(db, query: str, params: tuple = ()) -> str:
+    async with db.execute(f"EXPLAIN QUERY PLAN {query}", params) as cursor:
+        return " | ".join(row[3] for row in await cursor.fetchall())
+
+
+@pytest.mark.parametrize("query, params, expected", [
+    # کانفیگ‌های یک کاربر (get_user_configs)
+    ("SELECT * FROM configs WHERE owner_telegram_id = ? AND is_deleted = 0", (1,),
+     "SEARCH configs USING INDEX idx_configs_owner"),
+    # جستجو با ایمیل (get_config_by_email)
+    ("SELECT * FROM configs WHERE panel_client_email = ?", ("a",),
+     "SEARCH configs USING INDEX idx_configs_email"),
+    # کوئری همگام‌سازی ترافیک (get_active_configs_traffic) - فقط از ایندکس پوششی
+    ("SELECT panel_id, panel_client_email, id, owner_telegram_id, traffic_used_bytes "
+     "FROM configs WHERE is_deleted = 0", (),
+     "USING COVERING INDEX idx_configs_active_traffic"),
+    # کانفیگ‌های حذف شده در انتظار آرشیو (archive_deleted_configs)
+    ("SELECT id FROM configs WHERE is_deleted = 1 ORDER BY id LIMIT ?", (500,),
+     "idx_configs_deleted"),
+])
+def test_config_queries_use_indexes(db_path, query, params, expected):
+    async def run():
+        await database.init_db()
+        db = await database.get_db()
+        assert expected in await _plan(db, query, params)
+    
+    asyncio.run(run())
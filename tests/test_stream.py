@@ -0,0 +1,57 @@
+# تست پارس تدریجی لیست inboundها
+
+import asyncio
+import json
+
+import api
+from models import ClientStat, Inbound
+
+
+class _ChunkedContent:
+    """جایگزین StreamReader که پاسخ را در تکه‌های کوچک برمی‌گرداند"""
+    
+    def __init__(self, data: bytes, chunk_size: int):
+        self._data = data
+        self._pos = 0
+        self._chunk_size = chunk_size
+    
+    async def read(self, n: int) -> bytes:
+        chunk = self._data[self._pos:self._pos + min(n, self._chunk_size)]
+        self._pos += len(chunk)
+        return chunk
+
+
+def test_large_single_inbound_in_small_chunks():
+    count = 5000
+    clients = [{"id": f"uuid-{i}", "email": f"کاربر-{i}", "enable": True} for i in range(count)]
+    stats = [
+        {"id": i, "inboundId": 1, "enable": i % 2 == 0, "email": f"کاربر-{i}",
+         "up": i * 1000, "down": i * 3000}
+        for i in range(count)
+    ]
+    inbound = {
+        "id": 1, "remark": "سرور اصلی", "protocol": "vless", "port": 443, "enable": True,
+        "settings": json.dumps({"clients": clients}, ensure_ascii=False),
+        "streamSettings": "{}", "clientStats": stats
+    }
+    payload = json.dumps(
+        {"success": True, "msg": "", "obj": [inbound]}, ensure_ascii=False, indent=1
+    ).encode()
+    
+    async def parse(stream):
+        return [
+            item async for item in stream.items(nested={"clientStats": ClientStat.from_json})
+        ]
+    
+    # تکه با اندازه فرد تا کاراکترهای چندبایتی UTF-8 هم بین تکه‌ها شکسته شوند
+    stream = api._JSONStream(_ChunkedContent(payload, 997))
+    items = asyncio.run(parse(stream))
+    
+    assert stream.fields == {"success": True, "msg": ""}
+    assert len(items) == 1
+    parsed = Inbound.from_json(items[0])
+    assert parsed == Inbound.from_json(inbound)
+    assert parsed.settings == inbound["settings"]
+    assert all(isinstance(stat, ClientStat) for stat in items[0]["clientStats"])
+    assert parsed.clientStats[-1].email == f"کاربر-{count - 1}"
+    assert parsed.clientStats[-1].down == (count - 1) * 3000
@@ -0,0 +1,69 @@
+# تست همگام‌سازی ترافیک چند پنل
+
+import asyncio
+
+import api
+import database
+import scheduler
+from models import Inbound
+
+
+def _panel(panel_id: int, name: str, stats: list = None, error: Exception = None):
+    """پنل ساختگی که لیست inboundها را از stats می‌سازد یا با error شکست می‌خورد"""
+    panel = api.Panel3XUI(f"http://{name}", "user", "pass", panel_id=panel_id, name=name)
+    
+    async def stream_list(endpoint, nested=None, _retry=True):
+        if error:
+            raise error
+        yield {"id": 1, "protocol": "vless", "clientStats": stats or []}
+    
+    panel._stream_list = stream_list
+    return panel
+
+
+def test_failed_panel_keeps_stored_traffic(db_path, monkeypatch):
+    async def run():
+        await database.init_db()
+        await database.add_user(1)
+        await database.add_panel_node("node2", "http://node2", "user", "pass")
+        healthy_id = await database.add_config(1, "healthy", 1, 10, 0, panel_id=1)
+        down_id = await database.add_config(1, "down", 1, 10, 0, panel_id=2)
+        await database.update_configs_traffic([(healthy_id, 1000), (down_id, 1500)])
+        used_before = await database.get_user_total_traffic(1)
+        
+        healthy = _panel(1, "main", [{"email": "healthy", "inboundId": 1, "up": 3000, "down": 0}])
+        down = _panel(2, "node2", error=OSError("node down"))
+        # کش قدیمی پنل خراب نباید به عنوان داده تازه نوشته شود
+        down._inbounds_cache = [Inbound.from_json({
+            "id": 1, "clientStats": [{"email": "down", "inboundId": 1, "up": 1, "down": 0}]
+        })]
+        down._inbounds_fetched_at = 1.0
+        monkeypatch.setattr(scheduler, "get_panels", lambda: [healthy, down])
+        
+        result = await scheduler._sync_traffic()
+        
+        assert "node2" in result["error"]
+        assert result["changed"] == 1
+        assert (await database.get_config(healthy_id))["traffic_used_bytes"] == 3000
+        assert (await database.get_config(down_id))["traffic_used_bytes"] == 1500
+        assert await database.get_user_total_traffic(1) == used_before + 2000
+        assert "node2" in (await database.get_job_runs("traffic_sync"))[0]["error"]
+    
+    asyncio.run(run())
+
+
+def test_pick_inbound_skips_unsupported_protocols(monkeypatch):
+    panel = api.Panel3XUI("http://main", "user", "pass")
+    inbounds = [
+        Inbound.from_json({"id": 1, "protocol": "socks", "clientStats": []}),
+        Inbound.from_json({"id": 2, "protocol": "vless", "clientStats": [
+            {"email": "a", "inboundId": 2, "up": 0, "down": 0}
+        ]}),
+    ]
+    
+    async def get_all_inbounds(allow_stale=True):
+        return [(panel, inbounds)]
+    
+    monkeypatch.setattr(api, "get_all_inbounds", get_all_inbounds)
+    _, inbound = asyncio.run(api.pick_inbound())
+    assert inbound.id == 2